@@ -0,0 +1,169 @@
+"""
+Benchmarks sobre una imdb.sqlite ya construida
+
+    python3 bench.py layout [imdb.sqlite]
+    python3 bench.py search [imdb.sqlite]
+    python3 bench.py keys [imdb.sqlite]
+"""
+from core.dblite import DBlite
+from core.schema import INT_SUFFIX, REVERSE_INDEX, is_int_keys, to_int_keys
+from core.search import FTS_TABLE, has_title_index, normalize, re_word, to_match
+from tempfile import TemporaryDirectory
+from pathlib import Path
+from time import perf_counter
+import argparse
+import random
+
+SAMPLE = 2000
+
+# Tablas de clave compuesta y las busquedas que se hacen sobre ellas
+LOOKUPS = {
+    'TITLE': ('movie', ),
+    'DIRECTOR': ('movie', 'person'),
+}
+# Consultas con los ids en texto de siempre, que con claves enteras van contra las vistas
+KEY_QUERIES = {
+    'join TITLE-MOVIE': ("select count(*) from TITLE t join MOVIE m on m.id = t.movie", False),
+    'MOVIE id = ?': ("select * from MOVIE where id = ?", True),
+    'DIRECTOR movie = ?': ("select p.name from DIRECTOR d join PERSON p on p.id = d.person where d.movie = ?", True),
+    'TITLE movie = ?': ("select title from TITLE where movie = ?", True),
+}
+KEY_LAYOUTS = ('text', 'int')
+LAYOUTS = {
+    'rowid': ("", False),
+    'without_rowid': (" WITHOUT ROWID", False),
+    'without_rowid+reverse': (" WITHOUT ROWID", True),
+}
+
+
+def percentile(data: list[float], p: float):
+    data = sorted(data)
+    return data[min(len(data) - 1, int(len(data) * p))]
+
+
+def timeit(db: DBlite, sql: str, keys: tuple):
+    times = []
+    for k in keys:
+        start = perf_counter()
+        db.to_tuple(sql, k)
+        times.append((perf_counter() - start) * 1_000_000)
+    return times
+
+
+def physical(db: DBlite, table: str):
+    if db.to_tuple("select name from sqlite_master where type='table' and name=?", table + INT_SUFFIX):
+        return table + INT_SUFFIX
+    return table
+
+
+def bench_layout(file: str):
+    src = DBlite(file, quick_release=True)
+    tables = {t: physical(src, t) for t in LOOKUPS}
+    keys: dict[tuple[str, str], tuple] = {}
+    for t, cols in LOOKUPS.items():
+        for c in cols:
+            vals = src.to_tuple(f"select distinct {c} from {tables[t]}")
+            keys[(t, c)] = tuple(random.sample(vals, min(SAMPLE, len(vals))))
+    print(f"{'layout':<24} {'tabla':<10} {'MiB':>8} {'busqueda':<18} {'p50 µs':>8} {'p99 µs':>8}")
+    with TemporaryDirectory() as tmp:
+        for name, (suffix, reverse) in LAYOUTS.items():
+            for t, cols in LOOKUPS.items():
+                path = Path(tmp).joinpath(f"{name}.{t}.sqlite")
+                db = DBlite(str(path), quick_release=True)
+                info = tuple(src.select(f"pragma table_info({tables[t]})"))
+                pk = ", ".join(c[1] for c in sorted(info, key=lambda c: c[5]) if c[5] > 0)
+                defs = ", ".join(f"{c[1]} {c[2]} NOT NULL" for c in info)
+                db.execute("ATTACH DATABASE ? AS src", str(Path(file).resolve()))
+                db.execute(f"CREATE TABLE {t} ({defs}, PRIMARY KEY ({pk})){suffix}")
+                db.execute(f"INSERT INTO {t} SELECT * FROM src.{tables[t]} ORDER BY {pk}")
+                if reverse and t in REVERSE_INDEX:
+                    db.execute(f"CREATE INDEX {t}_REVERSE ON {t}({', '.join(REVERSE_INDEX[t])})")
+                db.commit()
+                db.execute("DETACH DATABASE src")
+                db.execute("VACUUM")
+                size = path.stat().st_size / 1024 / 1024
+                for c in cols:
+                    other = ", ".join(x[1] for x in info if x[1] != c)
+                    times = timeit(db, f"select {other} from {t} where {c} = ?", keys[(t, c)])
+                    print(f"{name:<24} {t:<10} {size:>8.1f} {c + ' = ?':<18} {percentile(times, 0.5):>8.1f} {percentile(times, 0.99):>8.1f}")
+                db.close()
+
+
+def bench_keys(file: str):
+    src = DBlite(file, readonly=True)
+    if is_int_keys(src):
+        raise SystemExit(f"{file} ya tiene claves enteras, hace falta una con los ids en texto")
+    movies = src.to_tuple(f"select id from MOVIE order by random() limit {SAMPLE // 10}")
+    print(f"{'layout':<16} {'MiB':>8} {'consulta':<20} {'n':>5} {'p50 ms':>10} {'max ms':>10}")
+    with TemporaryDirectory() as tmp:
+        for name in KEY_LAYOUTS:
+            path = Path(tmp).joinpath(f"{name}.sqlite")
+            src.execute("VACUUM INTO ?", str(path))
+            db = DBlite(str(path), quick_release=True)
+            if name == 'int':
+                to_int_keys(db)
+            db.execute("VACUUM")
+            size = path.stat().st_size / 1024 / 1024
+            for q, (sql, by_id) in KEY_QUERIES.items():
+                keys = movies if by_id else (None, )
+                times = []
+                for k in keys:
+                    start = perf_counter()
+                    db.to_tuple(sql, *(() if k is None else (k, )))
+                    times.append((perf_counter() - start) * 1000)
+                print(f"{name:<16} {size:>8.1f} {q:<20} {len(keys):>5} {percentile(times, 0.5):>10.2f} {max(times):>10.2f}")
+            db.close()
+    src.close()
+
+
+def search_queries(db: DBlite, n: int):
+    """
+    Lo que escribiria alguien buscando un titulo: las primeras palabras
+    en minusculas y sin tildes, la ultima a veces a medias
+    """
+    titles = db.to_tuple(f"select title from {physical(db, 'TITLE')} order by random() limit {n}")
+    for t in titles:
+        words = re_word.findall(normalize(t))[:random.randint(1, 3)]
+        if not words:
+            continue
+        if len(words[-1]) > 3 and random.random() < 0.5:
+            words[-1] = words[-1][:random.randint(3, len(words[-1]) - 1)]
+        yield " ".join(words)
+
+
+def bench_search(file: str):
+    db = DBlite(file, readonly=True)
+    if not has_title_index(db):
+        raise SystemExit(f"{file} no tiene {FTS_TABLE}, crealo con create.py")
+    queries = tuple(search_queries(db, SAMPLE))
+    # LIKE recorre toda la tabla en cada busqueda, con menos basta
+    like = f"select distinct movie from {physical(db, 'TITLE')} where title like ? limit 20"
+    fts = f"select rowid from {FTS_TABLE} where {FTS_TABLE} match ? order by rank limit 20"
+    print(f"{len(queries)} busquedas, ej: {', '.join(map(repr, queries[:3]))}")
+    print(f"{'busqueda':<10} {'n':>6} {'con resultado':>14} {'p50 µs':>10} {'p99 µs':>10}")
+    for name, sql, keys in (
+        ('like', like, tuple(f"%{q}%" for q in queries[:SAMPLE // 20])),
+        ('fts5', fts, tuple(map(to_match, queries))),
+    ):
+        found = sum(1 for k in keys if db.to_tuple(sql, k))
+        times = timeit(db, sql, keys)
+        print(f"{name:<10} {len(keys):>6} {found:>14} {percentile(times, 0.5):>10.1f} {percentile(times, 0.99):>10.1f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks sobre imdb.sqlite")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("layout", help="tamaño y latencia de TITLE y DIRECTOR con y sin WITHOUT ROWID")
+    p.add_argument("db", nargs="?", default="imdb.sqlite")
+    p = sub.add_parser("search", help="busqueda de titulos con LIKE y con el indice fts5")
+    p.add_argument("db", nargs="?", default="imdb.sqlite")
+    p = sub.add_parser("keys", help="tamaño y consultas por id con ids en texto y con claves enteras")
+    p.add_argument("db", nargs="?", default="imdb.sqlite")
+    args = parser.parse_args()
+    if args.cmd == "keys":
+        bench_keys(args.db)
+    if args.cmd == "layout":
+        bench_layout(args.db)
+    if args.cmd == "search":
+        bench_search(args.db)
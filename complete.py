@@ -1,4 +1,4 @@
-from core.dblite import DBlite, gW
+from core.dblite import DBlite
 from core.filemanager import FM
 from core.wiki import WIKI
 from core.config_log import config_log
@@ -7,7 +7,9 @@ from core.req import R
 import logging
 from sqlite3 import OperationalError
 from core.imdb import IMDB
+from core.schema import drop_table, is_int_keys, to_int_keys
 from os import environ
+from core.idset import IdSet
 
 config_log("log/complete_db.log")
 
@@ -59,12 +61,12 @@ def dump_dict(name: str):
 
 
 def union(*args):
-    s = set()
+    s = IdSet("tt")
     for a in args:
         if isinstance(a, dict):
             a = a.keys()
-        s = s.union(a)
-    return sorted(s)
+        s.update(a)
+    return s
 
 
 wiki = load_dict("wikipedia")
@@ -73,11 +75,13 @@ cntr = load_dict("countries")
 
 ids = IMDB.scrape(*environ.get('SCRAPE_URLS', '').split())
 if len(ids):
-    ids = DB.to_tuple(f"select id from movie where id {gW(ids)}", *ids)
+    ids = DB.to_tuple(f"select id from movie where id in {DB.id_table('SCRAPED', ids)}")
 
+INT_KEYS = is_int_keys(DB)
+drop_table(DB, "EXTRA")
 DB.executescript(FM.load("sql/extra.sql"))
 
-ids = set(ids)
+ids = IdSet("tt", ids)
 cntr = {
     **cntr,
     **IMDB.get_countries(*ids.difference(cntr.keys()))
@@ -99,6 +103,8 @@ for i in ids:
     )
 DB.flush()
 DB.commit()
+if INT_KEYS:
+    to_int_keys(DB)
 
 dump_dict('wikipedia')
 dump_dict('filmaffinity')
@@ -0,0 +1 @@
+# hace que pytest ponga la raiz del repo en sys.path para importar core
@@ -0,0 +1,223 @@
+from array import array
+from pathlib import Path
+from itertools import islice, chain, compress
+from mmap import mmap, ACCESS_READ
+from typing import Any, Callable, Iterable
+import hashlib
+import shutil
+import logging
+from core.filemanager import FM
+
+logger = logging.getLogger(__name__)
+
+TYPECODE = {
+    'int': 'q',
+    'float': 'd',
+    'bool': 'b',
+}
+CHUNK = 65536
+
+
+def file_sha256(path: Path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for b in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+def _to_raw(kind: str, v):
+    if v is None:
+        return '\\N'
+    if kind == 'bool':
+        return '1' if v else '0'
+    if kind == 'list':
+        return ",".join(v) if v else '\\N'
+    return str(v)
+
+
+class ColumnWriter:
+    """
+    Guarda filas ya decodificadas columna a columna:
+    - int, float y bool como arrays tipados
+    - str y list como un fichero de offsets (int64) mas los bytes utf-8,
+      cada valor terminado en \\n (que nunca aparece en un tsv)
+    - un fichero .null por columna con 1 byte por fila
+    """
+
+    def __init__(self, path: Path, header: tuple[str, ...], kinds: tuple[str, ...]):
+        self.__path = path
+        self.__header = header
+        self.__kinds = kinds
+        self.__rows = 0
+        self.__nulls = [False] * len(header)
+        self.__offsets = [0] * len(header)
+        path.mkdir(parents=True, exist_ok=True)
+        self.__files = []
+        for c, k in zip(header, kinds):
+            fls = [open(path.joinpath(f"{c}.null"), "wb")]
+            if k in TYPECODE:
+                fls.append(open(path.joinpath(f"{c}.{TYPECODE[k]}"), "wb"))
+            else:
+                fls.append(open(path.joinpath(f"{c}.off"), "wb"))
+                fls.append(open(path.joinpath(f"{c}.str"), "wb"))
+                array('q', [0]).tofile(fls[1])
+            self.__files.append(fls)
+
+    def write(self, rows: Iterable[tuple]):
+        it = iter(rows)
+        while True:
+            chunk = list(islice(it, CHUNK))
+            if not chunk:
+                break
+            self.__write(chunk)
+
+    def __write(self, rows: list[tuple]):
+        self.__rows += len(rows)
+        for j, (kind, fls) in enumerate(zip(self.__kinds, self.__files)):
+            vals = [r[j] for r in rows]
+            nulls = bytes(v is None for v in vals)
+            if not self.__nulls[j] and any(nulls):
+                self.__nulls[j] = True
+            fls[0].write(nulls)
+            if kind in TYPECODE:
+                array(TYPECODE[kind], (0 if v is None else v for v in vals)).tofile(fls[1])
+                continue
+            if kind == 'list':
+                vals = [",".join(v) if v else None for v in vals]
+            data = [b'\n' if v is None else v.encode('utf-8') + b'\n' for v in vals]
+            off = array('q')
+            pos = self.__offsets[j]
+            for d in data:
+                pos = pos + len(d)
+                off.append(pos)
+            self.__offsets[j] = pos
+            off.tofile(fls[1])
+            fls[2].write(b''.join(data))
+
+    def close(self):
+        for fls in self.__files:
+            for f in fls:
+                f.close()
+        FM.dump(self.__path.joinpath("meta.json"), {
+            'header': self.__header,
+            'kinds': self.__kinds,
+            'nulls': self.__nulls,
+            'rows': self.__rows
+        })
+
+
+class ColumnReader:
+    """
+    Lee (via mmap) lo guardado por ColumnWriter
+    """
+
+    def __init__(self, path: Path):
+        self.__path = path
+        meta = FM.load(path.joinpath("meta.json"))
+        self.header: tuple[str, ...] = tuple(meta['header'])
+        self.rows: int = meta['rows']
+        self.__kinds = dict(zip(self.header, meta['kinds']))
+        self.__nulls = dict(zip(self.header, meta['nulls']))
+
+    def __map(self, name: str):
+        file = self.__path.joinpath(name)
+        if file.stat().st_size == 0:
+            return memoryview(b'')
+        with open(file, "rb") as f:
+            return memoryview(mmap(f.fileno(), 0, access=ACCESS_READ))
+
+    def __iter_chunks(self, c: str):
+        kind = self.__kinds[c]
+        nulls = self.__map(f"{c}.null") if self.__nulls[c] else None
+        if kind in TYPECODE:
+            vals = self.__map(f"{c}.{TYPECODE[kind]}").cast(TYPECODE[kind])
+        else:
+            off = self.__map(f"{c}.off").cast('q')
+            data = self.__map(f"{c}.str")
+        for a in range(0, self.rows, CHUNK):
+            b = min(a + CHUNK, self.rows)
+            if kind in TYPECODE:
+                chunk = vals[a:b].tolist()
+                if kind == 'bool':
+                    chunk = list(map(bool, chunk))
+            else:
+                chunk = str(data[off[a]:off[b]], 'utf-8').split('\n')
+                chunk.pop()
+                if kind == 'list':
+                    chunk = [tuple(v.split(",")) if v else tuple() for v in chunk]
+            if nulls is not None:
+                mask = nulls[a:b].tobytes()
+                if b'\x01' in mask:
+                    chunk = [None if n else v for v, n in zip(chunk, mask)]
+            yield chunk
+
+    def iter_column(self, c: str):
+        return chain.from_iterable(self.__iter_chunks(c))
+
+    def iter_raw(self, c: str):
+        kind = self.__kinds[c]
+        if kind == 'str':
+            if not self.__nulls[c]:
+                return self.iter_column(c)
+            return ('\\N' if v is None else v for v in self.iter_column(c))
+        return (_to_raw(kind, v) for v in self.iter_column(c))
+
+    def iter_rows(
+        self,
+        columns: tuple[str, ...],
+        where: Callable[..., bool] = None,
+        where_cols: tuple[str, ...] = None
+    ):
+        rows = zip(*map(self.iter_column, columns))
+        if where is None:
+            yield from rows
+            return
+        yield from compress(rows, map(where, *map(self.iter_raw, where_cols)))
+
+
+class ColumnCache:
+    """
+    Cache en disco de ficheros tsv ya decodificados,
+    indexada por el sha256 del fichero original
+    """
+
+    def __init__(self, root: str | Path):
+        self.__root = FM.resolve_path(root)
+
+    def target(self, source: Path, sha: str = None):
+        sha = sha or file_sha256(source)
+        return self.__root.joinpath(f"{source.name}.{sha[:16]}")
+
+    def get(self, source: Path, sha: str = None) -> ColumnReader | None:
+        target = self.target(source, sha)
+        if not target.joinpath("meta.json").is_file():
+            return None
+        logger.info(f"{source} -> {target}")
+        return ColumnReader(target)
+
+    def put(
+        self,
+        source: Path,
+        header: tuple[str, ...],
+        kinds: tuple[str, ...],
+        rows: Iterable[tuple[Any, ...]],
+        sha: str = None
+    ) -> ColumnReader:
+        target = self.target(source, sha)
+        for old in self.__root.glob(f"{source.name}.*"):
+            if old.is_dir() and old != target:
+                shutil.rmtree(old)
+        tmp = target.with_name(target.name + ".tmp")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        logger.info(f"{source} -> {tmp}")
+        w = ColumnWriter(tmp, header, kinds)
+        try:
+            w.write(rows)
+        finally:
+            w.close()
+        if target.exists():
+            shutil.rmtree(target)
+        tmp.rename(target)
+        return ColumnReader(target)
@@ -0,0 +1,173 @@
+from urllib.request import Request, urlopen
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlparse
+from http.client import HTTPResponse, HTTPException
+from socket import timeout
+from pathlib import Path
+from time import sleep
+from os.path import basename
+import shutil
+import logging
+from core.filemanager import FM
+from core.columnar import file_sha256
+from core.util import get_env
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetStore:
+    """
+    Copia local de los ficheros de https://datasets.imdbws.com
+
+    Cada fichero se guarda en `root` junto a un `.json` con su ETag y Last-Modified,
+    de manera que en las siguientes ejecuciones solo se descarga si ha cambiado.
+    Las descargas se hacen sobre un `.part` que se reanuda con Range si se corta.
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        mirror: str = None,
+        offline: bool = False,
+        chances: int = 5,
+        wait: int = 10,
+        timeout: int = 60
+    ):
+        """
+        Parameters
+        ----------
+        root: str | Path
+            directorio donde se guardan los ficheros
+        mirror: str
+            url base que sustituye a la del fichero pedido (ej: un servidor http local)
+        offline: bool
+            si es True no se hace ninguna peticion y se usa lo que haya en `root`
+        """
+        self.__root = FM.resolve_path(root)
+        self.__mirror = mirror.rstrip("/") if mirror else None
+        self.__offline = offline
+        self.__chances = max(chances, 1)
+        self.__wait = wait
+        self.__timeout = timeout
+
+    @property
+    def root(self):
+        return self.__root
+
+    def local_path(self, url: str) -> Path:
+        return self.__root.joinpath(basename(urlparse(url).path))
+
+    def remote_url(self, url: str) -> str:
+        if self.__mirror is None:
+            return url
+        return self.__mirror + "/" + basename(urlparse(url).path)
+
+    def get(self, url: str) -> Path:
+        """
+        Devuelve la ruta local de `url`, descargandola o revalidandola si hace falta
+        """
+        target = self.local_path(url)
+        if self.__offline:
+            if not target.is_file():
+                raise FileNotFoundError(f"{target} no existe y se esta en modo offline")
+            return target
+        remote = self.remote_url(url)
+        for i in range(1, self.__chances + 1):
+            try:
+                self.__download(remote, target)
+                return target
+            except (HTTPError, URLError, HTTPException, timeout, ConnectionError) as e:
+                if isinstance(e, HTTPError) and e.code < 500 and e.code != 429:
+                    raise
+                if i == self.__chances:
+                    if target.is_file():
+                        logger.critical(f"[KO] {remote} {e}, se usa {target}")
+                        return target
+                    raise
+                logger.warning(f"[{i}/{self.__chances}] {remote} {e}")
+                sleep(self.__wait)
+
+    def version(self, url: str) -> str:
+        """
+        Identifica el contenido de `url` (descargandola o revalidandola
+        si hace falta): su ETag o, si no lo hay, el sha256 del fichero
+        """
+        target = self.get(url)
+        etag = self.__load_meta(target).get('etag')
+        if etag:
+            return etag
+        return file_sha256(target)
+
+    def __meta_path(self, target: Path):
+        return target.with_name(target.name + ".json")
+
+    def __load_meta(self, target: Path) -> dict:
+        meta = self.__meta_path(target)
+        if not meta.is_file():
+            return {}
+        data = FM.load(meta)
+        if not isinstance(data, dict):
+            return {}
+        return data
+
+    def __download(self, url: str, target: Path):
+        part = target.with_name(target.name + ".part")
+        meta = self.__load_meta(target)
+        headers = {}
+        if target.is_file():
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        offset = part.stat().st_size if part.is_file() else 0
+        validator = meta.get('part', {}).get('etag') or meta.get('part', {}).get('last_modified')
+        if offset > 0 and validator:
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = validator
+        else:
+            offset = 0
+        r: HTTPResponse
+        try:
+            r = urlopen(Request(url, headers=headers), timeout=self.__timeout)
+        except HTTPError as e:
+            if e.code == 304:
+                logger.info(f"{url} no ha cambiado")
+                return
+            if e.code == 416 and offset > 0:
+                # el .part no vale (por ejemplo ya estaba completo), se empieza de cero
+                logger.warning(f"{url} {e}, se descarta {part}")
+                part.unlink()
+                return self.__download(url, target)
+            raise
+        with r:
+            if r.status != 206:
+                offset = 0
+            meta['part'] = {
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified')
+            }
+            FM.dump(self.__meta_path(target), meta)
+            length = r.headers.get('Content-Length')
+            size = offset + int(length) if length else None
+            if offset:
+                logger.info(f"{url} reanudado en {offset} bytes")
+            else:
+                logger.info(f"{url} -> {target}")
+            with open(part, "ab" if offset else "wb") as f:
+                shutil.copyfileobj(r, f, 1024 * 1024)
+        if size is not None and part.stat().st_size != size:
+            raise HTTPException(f"{url} incompleto: {part.stat().st_size} de {size} bytes")
+        part.replace(target)
+        meta = {
+            'url': url,
+            'size': target.stat().st_size,
+            **meta.pop('part')
+        }
+        FM.dump(self.__meta_path(target), meta)
+
+
+DS = DatasetStore(
+    get_env('IMDB_DATASET_DIR', default='dataset'),
+    mirror=get_env('IMDB_DATASET_URL'),
+    offline=get_env('IMDB_DATASET_OFFLINE') is not None
+)
@@ -2,45 +2,340 @@
 import sqlite3
 from sqlite3 import InterfaceError, OperationalError
 from os.path import isfile
-from os import remove
+from os import remove, replace
 from atexit import register
 from collections import defaultdict
+from typing import Iterable, Iterator
+from time import perf_counter
+from queue import Queue
+from threading import Thread, Lock, local
+from pathlib import Path
+from weakref import WeakSet
 import logging
+import os
+import random
+from core.util import get_env
 
 logger = logging.getLogger(__name__)
 
 
-def gW(tp: tuple):
-    if len(tp) == 0:
-        return None
-    if len(tp) == 1:
-        return "= ?"
-    prm = ", ".join(['?'] * len(tp))
-    return f"in ({prm})"
+def _row_bytes(row: tuple):
+    return sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in row)
+
+
+def _iter_batch(rows: Iterator[tuple], size: int, stats: dict[str, int | bool]):
+    total = 0
+    for row in rows:
+        yield row
+        n = _row_bytes(row)
+        total = total + n
+        stats['rows'] += 1
+        stats['bytes'] += n
+        if total >= size:
+            return
+    stats['eof'] = True
+
+
+class AsyncWriter:
+    """
+    Hilo que aplica en orden los executemany y commit de una conexion
+    para que quien genera las filas pueda seguir trabajando mientras tanto.
+    La cola admite `maxsize` lotes (si se llena, put espera) y el primer
+    error se relanza en el hilo que usa el writer en el siguiente put o sync;
+    lo que estuviera en cola detras del error se descarta.
+    Antes de cada fork (ProcessPoolExecutor de core.tsv, core.shard...)
+    se escribe lo pendiente y se para el hilo (ver pause), para que el
+    proceso hijo no herede la conexion a medio usar ni los locks de la cola
+    """
+
+    def __init__(self, con: sqlite3.Connection, maxsize: int = 4):
+        self.__con = con
+        self.__q: Queue[tuple[str, list[tuple]] | None] = Queue(maxsize=maxsize)
+        self.__error: BaseException = None
+        self.__reported = False
+        self.__th: Thread = None
+        _WRITERS.add(self)
+
+    def __start(self):
+        self.__th = Thread(target=self.__run, name="DBlite-writer", daemon=True)
+        self.__th.start()
+
+    def __run(self):
+        while True:
+            item = self.__q.get()
+            try:
+                if item is None:
+                    return
+                if self.__error is not None:
+                    continue
+                sql, rows = item
+                if sql is None:
+                    self.__con.commit()
+                else:
+                    self.__con.executemany(sql, rows)
+            except BaseException as e:
+                logger.critical(item[0])
+                self.__error = e
+            finally:
+                self.__q.task_done()
+
+    def __check(self):
+        if self.__error is not None and not self.__reported:
+            self.__reported = True
+            raise self.__error
+
+    def put(self, sql: str, rows: list[tuple]):
+        self.__check()
+        if self.__error is None:
+            if self.__th is None:
+                self.__start()
+            self.__q.put((sql, rows))
+
+    def commit(self):
+        self.put(None, None)
+
+    def sync(self):
+        self.__q.join()
+        try:
+            self.__check()
+        finally:
+            self.__error = None
+            self.__reported = False
+
+    def pause(self):
+        """
+        Espera a que se escriba lo pendiente y para el hilo, que se vuelve
+        a arrancar en el siguiente put. Un error no se relanza aqui
+        sino, como siempre, en el siguiente put o sync
+        """
+        if self.__th is None:
+            return
+        self.__q.put(None)
+        self.__th.join()
+        self.__th = None
+
+    def close(self):
+        self.sync()
+        self.pause()
+
+
+_WRITERS: WeakSet[AsyncWriter] = WeakSet()
+
+
+def _before_fork():
+    for w in tuple(_WRITERS):
+        w.pause()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork)
+
+
+BATCH_BYTES = 4 * 1024 * 1024
+TXN_BYTES = 256 * 1024 * 1024
+# pasos de DBlite.finalize que se hacen al cerrar si no es quick_release
+FINALIZE_STEPS = ('analyze', 'optimize', 'integrity_check', 'quick_check', 'foreign_key_check', 'vacuum', 'vacuum_into')
+FINALIZE = tuple(get_env('DB_FINALIZE', default='integrity_check,foreign_key_check,vacuum').split(","))
+# conexiones de solo lectura: el mmap lo comparten todas (es la cache del SO)
+READ_PRAGMAS = {
+    'mmap_size': int(get_env('DB_MMAP_SIZE', default=str(1024 * 1024 * 1024))),
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+BULK_PRAGMAS = {
+    'journal_mode': 'OFF',
+    'synchronous': 'OFF',
+    'cache_size': -1024 * 1024,
+    'locking_mode': 'EXCLUSIVE',
+}
 
 
 class DBlite:
-    def __init__(self, file: str, reload: bool = False, quick_release: bool = False):
+    def __init__(
+        self,
+        file: str,
+        reload: bool = False,
+        quick_release: bool = False,
+        bulk: bool = False,
+        async_write: bool = False,
+        finalize: tuple[str, ...] = None,
+        readonly: bool = False,
+        immutable: bool = False
+    ):
+        """
+        Parameters
+        ----------
+        bulk: bool
+            perfil de carga masiva para bases de datos que se regeneran enteras:
+            sin journal ni sync y con mas cache, se revierte al cerrar
+        async_write: bool
+            las escrituras en lote (executemany, flush, insert_rows) se hacen
+            en un hilo aparte (ver AsyncWriter); el resto de operaciones
+            esperan a que ese hilo haya terminado lo pendiente
+        finalize: tuple[str, ...]
+            pasos a dar al cerrar (ver DBlite.finalize), por defecto
+            los de la variable de entorno DB_FINALIZE o, si no esta,
+            integrity_check, foreign_key_check y vacuum
+        readonly: bool
+            para consultar desde varios hilos: cada hilo usa su propia conexion
+            (mode=ro, con mmap, ver READ_PRAGMAS) y no se puede escribir
+        immutable: bool
+            como readonly pero ademas se avisa a sqlite de que el fichero
+            no va a cambiar mientras este abierto, asi que no usa bloqueos
+        """
         self.__file = file
+        self.__readonly = readonly or immutable
+        self.__immutable = immutable
+        self.__local = local()
+        self.__lock = Lock()
+        self.__pool: list[sqlite3.Connection] = []
+        if self.__readonly and (reload or bulk or async_write):
+            raise ValueError("readonly no es compatible con reload, bulk ni async_write")
         if reload and isfile(self.__file):
             remove(self.__file)
         self.__con = None
         self.__many: dict[str, list[tuple]] = defaultdict(list)
         self.__quick_release = quick_release
+        self.__bulk = bulk
+        self.__pragmas: dict[str, str | int] = {}
+        self.__staged: dict[str, tuple[tuple[str, ...], str | None]] = {}
+        self.__async_write = async_write
+        self.__writer: AsyncWriter = None
+        self.__finalize = tuple(s.strip() for s in (FINALIZE if finalize is None else finalize) if s.strip())
+        for i, step in enumerate(self.__finalize):
+            name = step.split(":")[0]
+            if name not in FINALIZE_STEPS:
+                raise ValueError(f"{step} no es un paso de finalize: {', '.join(FINALIZE_STEPS)}")
+            if name == 'vacuum_into' and i < len(self.__finalize) - 1:
+                raise ValueError("vacuum_into tiene que ser el ultimo paso de finalize")
         register(self.close)
 
     @property
     def file(self):
         return self.__file
 
+    def __connect_ro(self):
+        uri = Path(self.__file).resolve().as_uri() + "?mode=ro"
+        if self.__immutable:
+            uri = uri + "&immutable=1"
+        con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        for k, v in READ_PRAGMAS.items():
+            con.execute(f"pragma {k} = {v}")
+        with self.__lock:
+            self.__pool.append(con)
+        return con
+
     @property
     def con(self):
+        if self.__readonly:
+            con = getattr(self.__local, 'con', None)
+            if con is None:
+                con = self.__connect_ro()
+                self.__local.con = con
+            return con
         if self.__con is None:
             logger.info(f"Connecting to {self.__file}")
-            self.__con = sqlite3.connect(self.__file)
+            self.__con = sqlite3.connect(self.__file, check_same_thread=not self.__async_write)
+            if self.__bulk:
+                for k, v in BULK_PRAGMAS.items():
+                    self.__pragmas[k] = self.__con.execute(f"pragma {k}").fetchone()[0]
+                    self.__con.execute(f"pragma {k} = {v}")
         return self.__con
 
+    def __sync(self):
+        if self.__writer is not None:
+            self.__writer.sync()
+
+    def __write(self, sql: str, rows: list[tuple] | Iterable[tuple]):
+        if not self.__async_write:
+            return self.con.executemany(sql, rows)
+        if self.__writer is None:
+            self.__writer = AsyncWriter(self.con)
+        self.__writer.put(sql, rows)
+
+    def __columns(self, table: str):
+        return tuple(self.select(f"pragma table_info({table})"))
+
+    @staticmethod
+    def __column_def(col: tuple):
+        _, name, tp, notnull, dflt, _ = col
+        line = f"{name} {tp}".strip()
+        if notnull:
+            line = line + " NOT NULL"
+        if dflt is not None:
+            line = line + f" DEFAULT {dflt}"
+        return line
+
+    def stage(self, *tables: str, on_conflict: str = None):
+        """
+        Cambia cada tabla por una copia sin claves ni indices (staging)
+        para que los INSERT no tengan que mantener ningun B-tree.
+        La copia conserva el tipo, NOT NULL y DEFAULT de cada columna,
+        asi que esos errores siguen saltando al insertar.
+        La tabla original (vacia) se guarda como {table}__BULK y
+        se rellena en una sola pasada ordenada en unstage(), donde
+        las claves repetidas dan error salvo que se indique `on_conflict`
+        (IGNORE para quedarse con una fila de cada clave, como haria
+        INSERT OR IGNORE contra la tabla real)
+        """
+        for t in tables:
+            if t in self.__staged:
+                continue
+            indexes = self.to_tuple(
+                "select sql from sqlite_master where type='index' and tbl_name=? and sql is not null",
+                t
+            )
+            for name in self.to_tuple(
+                "select name from sqlite_master where type='index' and tbl_name=? and sql is not null",
+                t
+            ):
+                self.execute(f"DROP INDEX {name}")
+            cols = ", ".join(map(self.__column_def, self.__columns(t)))
+            self.execute("pragma legacy_alter_table = ON")
+            self.execute(f"ALTER TABLE {t} RENAME TO {t}__BULK")
+            self.execute("pragma legacy_alter_table = OFF")
+            self.execute(f"CREATE TABLE {t} ({cols})")
+            self.__staged[t] = (indexes, on_conflict)
+            logger.info(f"{t} en modo staging")
+
+    def unstage(self):
+        """
+        Vuelca cada tabla de staging en su tabla original, ordenando por
+        su clave primaria, y crea despues sus indices
+        """
+        self.flush()
+        for t, (indexes, on_conflict) in list(self.__staged.items()):
+            start = perf_counter()
+            cols = self.__columns(f"{t}__BULK")
+            names = ", ".join(c[1] for c in cols)
+            order = ", ".join(c[1] for c in sorted(cols, key=lambda c: c[5]) if c[5] > 0)
+            verb = "INSERT" if on_conflict is None else f"INSERT OR {on_conflict.upper()}"
+            self.execute(
+                f"{verb} INTO {t}__BULK ({names}) SELECT {names} FROM {t}" +
+                (f" ORDER BY {order}" if order else ""),
+                log_level=logging.INFO
+            )
+            self.execute(f"DROP TABLE {t}")
+            self.execute("pragma legacy_alter_table = ON")
+            self.execute(f"ALTER TABLE {t}__BULK RENAME TO {t}")
+            self.execute("pragma legacy_alter_table = OFF")
+            for sql in indexes:
+                self.execute(sql, log_level=logging.INFO)
+            del self.__staged[t]
+            self.commit()
+            logger.info(f"{t} cargada en {perf_counter() - start:.1f}s")
+
+    def __end_bulk(self):
+        self.unstage()
+        self.commit()
+        for k, v in self.__pragmas.items():
+            self.__con.execute(f"pragma {k} = {v}")
+        self.__pragmas.clear()
+        # el locking_mode no se libera hasta el siguiente acceso
+        self.__con.execute("select 1 from sqlite_master limit 1").fetchall()
+
     def execute(self, sql: str, *args, log_level: int = None):
+        self.__sync()
         if log_level is not None:
             logger.log(log_level, sql)
         r = self.con.execute(sql, args)
@@ -49,17 +344,82 @@ class DBlite:
         return r
 
     def executescript(self, sql: str):
+        self.__sync()
         return self.con.executescript(sql)
 
     def executemany(self, sql: str, vals: tuple):
         self.__many[sql].append(vals)
         if len(self.__many[sql]) < 1000:
             return None
-        r = self.con.executemany(sql, self.__many[sql])
-        del self.__many[sql]
+        r = self.__write(sql, self.__many.pop(sql))
         return r
 
+    def insert_rows(
+        self,
+        table: str,
+        columns: tuple[str, ...],
+        rows: Iterable[tuple],
+        on_conflict: str = None,
+        batch_bytes: int = BATCH_BYTES,
+        txn_bytes: int = TXN_BYTES
+    ) -> int:
+        """
+        Inserta todas las filas de `rows` pasando el iterador directamente a
+        sqlite3.executemany en lotes de unos `batch_bytes` y haciendo commit
+        cada `txn_bytes`. Devuelve el numero de filas
+
+        Parameters
+        ----------
+        on_conflict: str
+            IGNORE, REPLACE, ... para generar INSERT OR {on_conflict}
+        """
+        verb = "INSERT" if on_conflict is None else f"INSERT OR {on_conflict.upper()}"
+        sql = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        self.flush()
+        rows = iter(rows)
+        stats = {'rows': 0, 'bytes': 0, 'eof': False}
+        start = perf_counter()
+        pending = 0
+        while not stats['eof']:
+            done = stats['bytes']
+            batch = _iter_batch(rows, batch_bytes, stats)
+            if self.__async_write:
+                batch = list(batch)
+            try:
+                self.__write(sql, batch)
+            except InterfaceError:
+                logger.critical(sql)
+                raise
+            pending = pending + stats['bytes'] - done
+            if pending >= txn_bytes:
+                if self.__writer is not None:
+                    self.__writer.commit()
+                else:
+                    self.commit()
+                pending = 0
+        self.commit()
+        elapsed = perf_counter() - start
+        speed = stats['rows'] / elapsed if elapsed > 0 else 0
+        logger.info(
+            f"{table}: {stats['rows']} filas ({stats['bytes'] / 1024 / 1024:.0f} MiB) "
+            f"en {elapsed:.1f}s = {speed:.0f} filas/s"
+        )
+        return stats['rows']
+
+    def id_table(self, name: str, ids: Iterable) -> str:
+        """
+        Carga `ids` en la tabla temporal temp.{name} (con id como clave primaria)
+        y devuelve su nombre para usarla en las consultas con
+        `id in temp.{name}` o con un join, en vez de con una lista de parametros
+        """
+        table = f"temp.{name}"
+        self.execute(f"DROP TABLE IF EXISTS {table}")
+        self.execute(f"CREATE TEMP TABLE {name} (id PRIMARY KEY) WITHOUT ROWID")
+        self.insert_rows(table, ("id", ), ((i, ) for i in ids), on_conflict="IGNORE")
+        return table
+
     def select(self, sql: str, *args, **kwargs):
+        self.__sync()
         cursor = self.con.cursor()
         try:
             if len(args):
@@ -90,36 +450,95 @@ class DBlite:
     def flush(self):
         for sql, vals in self.__many.items():
             try:
-                self.con.executemany(sql, vals)
+                self.__write(sql, vals)
             except InterfaceError:
                 logger.critical(f"{sql} % {vals}")
                 raise
         self.__many.clear()
 
     def commit(self):
+        self.__sync()
         self.con.commit()
 
+    def __check(self, pragma: str):
+        ko = 0
+        for r in self.select(f"pragma {pragma}"):
+            if r[0] != 'ok':
+                ko = ko + 1
+                logger.warning(f"[KO] {pragma} = {r[0]}")
+        if ko == 0:
+            logger.info(f"[OK] {pragma}")
+
+    def finalize(self, *steps: str):
+        """
+        Pasos de mantenimiento, en el orden dado y cada uno con su tiempo en el log:
+        - analyze: estadisticas para el planificador (se guardan en la base de datos)
+        - optimize: pragma optimize
+        - integrity_check: completo, o integrity_check:N para solo N tablas al azar
+        - quick_check: como integrity_check pero sin comprobar los indices
+        - foreign_key_check
+        - vacuum
+        - vacuum_into[:page_size]: crea una copia compactada (con ese page_size)
+          que sustituye a la original al cerrar. Devuelve la ruta de esa copia
+        """
+        into = None
+        for step in steps:
+            name, _, arg = step.partition(":")
+            start = perf_counter()
+            if name == 'analyze':
+                self.execute("ANALYZE")
+            elif name == 'optimize':
+                self.execute("pragma optimize")
+            elif name == 'integrity_check' and arg:
+                tables = self.to_tuple("select name from sqlite_master where type='table' and name not like 'sqlite%'")
+                for t in random.sample(tables, min(int(arg), len(tables))):
+                    self.__check(f"integrity_check({t})")
+            elif name in ('integrity_check', 'quick_check'):
+                self.__check(name)
+            elif name == 'foreign_key_check':
+                c = self.execute("pragma foreign_key_check").fetchall()
+                if not c:
+                    logger.info("[OK] foreign_key_check")
+                else:
+                    logger.warning("[KO] foreign_key_check")
+                    for table, parent in set((i[0], i[2]) for i in c):
+                        logger.warning(f"  {table} -> {parent}")
+            elif name == 'vacuum':
+                self.execute("VACUUM")
+            elif name == 'vacuum_into':
+                into = self.__file + ".vacuum"
+                if isfile(into):
+                    remove(into)
+                if arg:
+                    self.execute(f"pragma page_size = {int(arg)}")
+                self.execute("VACUUM INTO ?", into)
+            self.commit()
+            logger.info(f"{step} en {perf_counter() - start:.1f}s")
+        return into
+
     def close(self):
+        if self.__readonly:
+            with self.__lock:
+                for con in self.__pool:
+                    con.close()
+                self.__pool.clear()
+            self.__local = local()
+            return
         if self.__con is None:
             return
         logger.info(f"Closing {self.__file}")
+        if self.__writer is not None:
+            self.flush()
+            self.__writer.close()
+            self.__writer = None
+        self.__async_write = False
+        if self.__bulk:
+            self.__end_bulk()
         self.commit()
+        into = None
         if not self.__quick_release:
-            c = self.execute("pragma integrity_check").fetchone()
-            c = c[0] if c and len(c) == 1 else c
-            if c == 'ok':
-                logger.info("[OK] integrity_check")
-            else:
-                logger.warning("[KO] integrity_check = " + (c or "¿?"))
-            c = self.execute("pragma foreign_key_check").fetchall()
-            if not c:
-                logger.info("[OK] foreign_key_check")
-            else:
-                logger.warning("[KO] foreign_key_check")
-                for table, parent in set((i[0], i[2]) for i in c):
-                    logger.warning(f"  {table} -> {parent}")
-            logger.info(f"Vacuum {self.__file}")
-            self.execute("VACUUM")
-            self.commit()
+            into = self.finalize(*self.__finalize)
         self.__con.close()
         self.__con = None
+        if into is not None:
+            replace(into, self.__file)
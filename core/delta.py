@@ -0,0 +1,178 @@
+from core.dblite import DBlite
+from core.filemanager import FM
+from core.schema import PREFIX, INT_SUFFIX, to_int, to_txt
+from contextlib import closing
+from os.path import isfile
+from time import perf_counter
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# version de cada fichero con el que se hizo la ultima carga (ver
+# DatasetStore.version), si ninguna cambia no hace falta volver a cargar
+SOURCE_TABLE = "SOURCE"
+
+
+class DeltaTable:
+    """
+    Tabla que ya tiene datos y se quiere rehacer escribiendo solo lo que cambia.
+    El contenido nuevo se carga en temp.{table}, que al tener el mismo nombre
+    oculta a la tabla real en todas las consultas que no indican el esquema,
+    y al final se comparan ambas por clave primaria para aplicar
+    solo los INSERT, UPDATE y DELETE necesarios.
+    Funciona tanto con la disposicion de ids en texto como con la de
+    claves enteras (ver core.schema.to_int_keys)
+    """
+
+    def __init__(self, db: DBlite, table: str):
+        self.table = table
+        self.physical = table
+        if db.to_tuple("select name from sqlite_master where type='table' and name=?", table + INT_SUFFIX):
+            self.physical = table + INT_SUFFIX
+        # cid, name, type, notnull, dflt_value, pk
+        self.columns = tuple(db.select(f"pragma main.table_info({self.physical})"))
+        self.names = tuple(c[1] for c in self.columns)
+        self.pk = tuple(c[1] for c in sorted(self.columns, key=lambda c: c[5]) if c[5] > 0)
+        self.prefix: dict[str, str] = {}
+        if self.physical != table:
+            if table in PREFIX and len(self.pk) == 1:
+                self.prefix[self.pk[0]] = PREFIX[table]
+            for fk in db.select(f"pragma main.foreign_key_list({self.physical})"):
+                ref = fk[2][:-len(INT_SUFFIX)] if fk[2].endswith(INT_SUFFIX) else fk[2]
+                if ref in PREFIX:
+                    self.prefix[fk[3]] = PREFIX[ref]
+
+    def __enc(self, name: str, alias: str):
+        col = f"{alias}.{name}"
+        if name in self.prefix:
+            return to_int(self.prefix[name], col)
+        return col
+
+    def __dec(self, name: str, alias: str):
+        col = f"{alias}.{name}"
+        if name in self.prefix:
+            return to_txt(self.prefix[name], col)
+        return col
+
+    def create_sql(self):
+        cols = ", ".join(
+            f"{n} {'TEXT' if n in self.prefix else tp}".strip()
+            for _, n, tp, *_ in self.columns
+        )
+        return f"CREATE TEMP TABLE {self.table} ({cols})"
+
+    def index_sql(self):
+        return f"CREATE INDEX temp.{self.table}__DELTA ON {self.table}({', '.join(self.pk)})"
+
+    def delete_sql(self):
+        on = " AND ".join(f"t.{n} = {self.__dec(n, 'm')}" for n in self.pk)
+        return (
+            f"DELETE FROM main.{self.physical} AS m "
+            f"WHERE NOT EXISTS (SELECT 1 FROM temp.{self.table} t WHERE {on})"
+        )
+
+    def upsert_sql(self):
+        same = " AND ".join(
+            f"m.{n} {'=' if n in self.pk else 'IS'} {self.__enc(n, 't')}"
+            for n in self.names
+        )
+        names = ", ".join(self.names)
+        vals = ", ".join(self.__enc(n, 't') for n in self.names)
+        return (
+            f"INSERT OR REPLACE INTO main.{self.physical} ({names}) "
+            f"SELECT {vals} FROM temp.{self.table} t "
+            f"WHERE NOT EXISTS (SELECT 1 FROM main.{self.physical} m WHERE {same}) "
+            f"ORDER BY {', '.join(self.__enc(n, 't') for n in self.pk)}"
+        )
+
+
+def _columns(con: sqlite3.Connection, table: str):
+    return tuple(r[1] for r in con.execute(f"pragma table_info({table})"))
+
+
+def can_delta(file: str, *tables: str):
+    """
+    Solo se puede hacer una carga incremental si ya existen todas las tablas
+    y las de sql/schema.sql tienen las mismas columnas (si el esquema cambia
+    se vuelve a cargar todo)
+    """
+    if not isfile(file):
+        return False
+    with closing(sqlite3.connect(":memory:")) as con:
+        con.executescript(FM.load("sql/schema.sql"))
+        schema = {t: _columns(con, t) for t in tables}
+    with closing(sqlite3.connect(file)) as con:
+        names = set(r[0] for r in con.execute(
+            "select name from sqlite_master where type in ('table', 'view')"
+        ))
+        if not names.issuperset(tables):
+            return False
+        for t, cols in schema.items():
+            if cols and _columns(con, t) != cols:
+                logger.info(f"{t} no tiene las columnas de sql/schema.sql, se carga entera")
+                return False
+    return True
+
+
+def read_sources(file: str) -> dict[str, str]:
+    """
+    Lo guardado con write_sources en `file` (sin abrirlo con DBlite,
+    para que si no hay nada que hacer no se toque la base de datos)
+    """
+    if not isfile(file):
+        return {}
+    with closing(sqlite3.connect(file)) as con:
+        try:
+            return dict(con.execute(f"select name, version from {SOURCE_TABLE}"))
+        except sqlite3.OperationalError:
+            return {}
+
+
+def write_sources(db: DBlite, sources: dict[str, str]):
+    db.execute(
+        f"CREATE TABLE IF NOT EXISTS {SOURCE_TABLE} ("
+        "name TEXT NOT NULL, version TEXT NOT NULL, PRIMARY KEY (name))"
+    )
+    db.execute(f"DELETE FROM {SOURCE_TABLE}")
+    db.insert_rows(SOURCE_TABLE, ("name", "version"), sorted(sources.items()))
+
+
+def stage_delta(db: DBlite, *tables: str):
+    """
+    Prepara `tables` para una carga incremental (ver DeltaTable)
+    """
+    delta = []
+    for t in tables:
+        d = DeltaTable(db, t)
+        if not d.pk:
+            raise ValueError(f"{t} no tiene clave primaria")
+        db.execute(f"DROP TABLE IF EXISTS temp.{t}")
+        db.execute(d.create_sql())
+        delta.append(d)
+        logger.info(f"{t} en modo incremental ({d.physical})")
+    return tuple(delta)
+
+
+def apply_delta(db: DBlite, delta: tuple[DeltaTable, ...]):
+    """
+    Aplica sobre las tablas reales la diferencia con lo cargado en temp.
+    Las tablas se borran en orden inverso y se rellenan en el orden dado
+    (primero las referenciadas) para no dejar referencias colgando
+    """
+    db.flush()
+    db.commit()
+    for d in delta:
+        db.execute(d.index_sql(), log_level=logging.INFO)
+    deleted = {}
+    for d in reversed(delta):
+        deleted[d.table] = db.execute(d.delete_sql(), log_level=logging.INFO).rowcount
+    for d in delta:
+        start = perf_counter()
+        changed = db.execute(d.upsert_sql(), log_level=logging.INFO).rowcount
+        db.execute(f"DROP TABLE temp.{d.table}")
+        db.commit()
+        logger.info(
+            f"{d.table}: {changed} filas nuevas o cambiadas, "
+            f"{deleted[d.table]} borradas en {perf_counter() - start:.1f}s"
+        )
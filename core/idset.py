@@ -0,0 +1,99 @@
+from typing import Iterable
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+re_nonzero = re.compile(rb"[^\x00]")
+
+
+class IdSet:
+    """
+    Conjunto de ids de IMDb de un mismo prefijo (tt0000001, nm0000001, ...)
+    guardado como un bitmap sobre su parte numerica:
+    un bit por id posible (unos 5 MiB para todos los tconst)
+    y comprobacion de pertenencia en O(1).
+    Los ids que no son del prefijo (vienen tambien de fuentes externas
+    como Wikidata) se ignoran con un aviso en vez de parar la carga
+    """
+
+    def __init__(self, prefix: str, ids: Iterable[str] = None):
+        self.prefix = prefix
+        self.__cut = len(prefix)
+        self.__bits = bytearray()
+        self.__len = 0
+        if ids is not None:
+            self.update(ids)
+
+    def __num(self, id: str) -> int | None:
+        if not isinstance(id, str) or id[:self.__cut] != self.prefix:
+            return None
+        try:
+            n = int(id[self.__cut:])
+        except ValueError:
+            return None
+        return n if n >= 0 else None
+
+    def __contains__(self, id: str):
+        n = self.__num(id)
+        if n is None:
+            return False
+        i = n >> 3
+        return i < len(self.__bits) and (self.__bits[i] >> (n & 7)) & 1 == 1
+
+    def add(self, id: str):
+        n = self.__num(id)
+        if n is None:
+            logger.warning(f"{id!r} no es un id {self.prefix}, se ignora")
+            return False
+        i, b = n >> 3, 1 << (n & 7)
+        if i >= len(self.__bits):
+            self.__bits.extend(bytes(max(i + 1 - len(self.__bits), len(self.__bits) // 2)))
+        if not self.__bits[i] & b:
+            self.__bits[i] |= b
+            self.__len += 1
+        return True
+
+    def discard(self, id: str):
+        n = self.__num(id)
+        if n is None:
+            return
+        i, b = n >> 3, 1 << (n & 7)
+        if i < len(self.__bits) and self.__bits[i] & b:
+            self.__bits[i] &= ~b
+            self.__len -= 1
+
+    def update(self, ids: Iterable[str]):
+        for i in ids:
+            self.add(i)
+
+    def difference_update(self, ids: Iterable[str]):
+        for i in ids:
+            self.discard(i)
+
+    def difference(self, ids: Iterable[str]):
+        s = self.copy()
+        s.difference_update(ids)
+        return s
+
+    def copy(self):
+        s = IdSet(self.prefix)
+        s.__bits = bytearray(self.__bits)
+        s.__len = self.__len
+        return s
+
+    def __iter__(self):
+        """
+        Ids en orden numerico
+        """
+        for m in re_nonzero.finditer(self.__bits):
+            i, byte = m.start(), m.group()[0]
+            for j in range(8):
+                if (byte >> j) & 1:
+                    yield f"{self.prefix}{i * 8 + j:07d}"
+
+    def __len__(self):
+        return self.__len
+
+    def __repr__(self):
+        return f"IdSet({self.prefix!r}, {self.__len} ids, {len(self.__bits)} bytes)"
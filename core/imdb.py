@@ -25,6 +25,11 @@ class Movie(NamedTuple):
     duration: int
     votes: int
     rating: float
+    titles: tuple[str, ...] = tuple()
+    directors: tuple[str, ...] = tuple()
+    filmaffinity: int = None
+    wikipedia: str = None
+    countries: tuple[str, ...] = tuple()
 
 
 class IMDBApi:
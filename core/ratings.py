@@ -0,0 +1,73 @@
+from core.dblite import DBlite
+from core.tsv import iter_tuples
+from core.schema import is_int_keys, id_to_int, to_int, to_txt, INT_SUFFIX, PREFIX
+from time import perf_counter
+from typing import Iterable
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+RATINGS_URL = "https://datasets.imdbws.com/title.ratings.tsv.gz"
+
+
+def refresh_ratings(db: DBlite, url: str = RATINGS_URL, keep: Iterable[str] = tuple()) -> int:
+    """
+    Carga title.ratings en una tabla temporal y actualiza MOVIE
+    (y MOVIE_SEARCH si existe) con un solo UPDATE ... FROM
+    que solo toca las filas que cambian.
+    Las peliculas que ya no estan en title.ratings se quedan en (0, 0),
+    como en create.py, salvo las de `keep` (las MAIN_MOVIES, que en ese
+    caso tienen la valoracion de OMDb, ver create.populate_main_ratings).
+    Devuelve el numero de peliculas actualizadas
+    """
+    start = perf_counter()
+    int_keys = is_int_keys(db)
+    table = "MOVIE" + INT_SUFFIX if int_keys else "MOVIE"
+    db.execute("DROP TABLE IF EXISTS temp.RATING")
+    db.execute(f"""
+        CREATE TEMP TABLE RATING (
+            id {'INTEGER' if int_keys else 'TEXT'} NOT NULL PRIMARY KEY,
+            rating FLOAT NOT NULL,
+            votes INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    rows = iter_tuples(url, 'tconst', 'averageRating', 'numVotes')
+    if int_keys:
+        rows = ((id_to_int(t), r, v) for t, r, v in rows)
+    db.insert_rows("temp.RATING", ("id", "rating", "votes"), rows, on_conflict="REPLACE")
+    cur = db.execute(
+        f"""
+        UPDATE {table} SET rating = r.rating, votes = r.votes
+        FROM temp.RATING r
+        WHERE {table}.id = r.id AND ({table}.rating != r.rating OR {table}.votes != r.votes)
+        """
+    )
+    count = cur.rowcount
+    keep = sorted(set(keep))
+
+    def reset(table: str, id: str, keep: list):
+        # las que ya no estan en title.ratings vuelven a (0, 0)
+        return db.execute(
+            f"UPDATE {table} SET rating = 0, votes = 0 "
+            "WHERE (rating != 0 OR votes != 0) "
+            f"AND NOT EXISTS (SELECT 1 FROM temp.RATING r WHERE r.id = {id}) "
+            "AND id NOT IN (SELECT value FROM json_each(?))",
+            json.dumps(keep)
+        ).rowcount
+
+    count = count + reset(table, f"{table}.id", [id_to_int(i) for i in keep] if int_keys else keep)
+    if db.to_tuple("select name from sqlite_master where type='table' and name='MOVIE_SEARCH'"):
+        rid = to_txt(PREFIX['MOVIE'], "r.id") if int_keys else "r.id"
+        db.execute(
+            f"""
+            UPDATE MOVIE_SEARCH SET rating = r.rating, votes = r.votes
+            FROM temp.RATING r
+            WHERE MOVIE_SEARCH.id = {rid} AND (MOVIE_SEARCH.rating != r.rating OR MOVIE_SEARCH.votes != r.votes)
+            """
+        )
+        reset("MOVIE_SEARCH", to_int(PREFIX['MOVIE'], "MOVIE_SEARCH.id") if int_keys else "MOVIE_SEARCH.id", keep)
+    db.execute("DROP TABLE temp.RATING")
+    db.commit()
+    logger.info(f"{count} valoraciones actualizadas en {perf_counter() - start:.1f}s")
+    return count
@@ -0,0 +1,230 @@
+from core.dblite import DBlite
+from core.imdb import Movie
+from core.schema import INT_SUFFIX, PREFIX, is_int_keys, to_int, to_txt
+from core.search import FTS_TABLE, to_match
+from core.filemanager import FM
+from collections import OrderedDict
+from threading import Lock
+from time import perf_counter
+from typing import Iterable
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# se guarda en cache que un id no existe para no volver a preguntar
+_MISSING = object()
+re_like = re.compile(r"[%_\\]")
+
+# tabla con una fila por pelicula ya desnormalizada (ver build_movie_search),
+# titulos y directores van como arrays json
+SEARCH_TABLE = "MOVIE_SEARCH"
+SEARCH_COLUMNS = (
+    "id", "title", "type", "year", "duration", "votes", "rating",
+    "titles", "directors", "filmaffinity", "wikipedia", "countries"
+)
+# como la tabla es WITHOUT ROWID cada indice ya lleva el id,
+# asi los listados filtrados u ordenados por estas columnas
+# se resuelven solo con el indice (y luego cada fila por su id)
+SEARCH_INDEXES = {
+    'YEAR': ('year', 'votes', 'rating'),
+    'RATING': ('rating', 'votes'),
+    'VOTES': ('votes', 'rating'),
+}
+
+
+class MovieRepository:
+    """
+    Lectura de peliculas de imdb.sqlite como core.imdb.Movie,
+    con sus titulos, directores y (si existe) lo de EXTRA.
+    Si existe SEARCH_TABLE se lee de ahi, si no de las tablas de siempre.
+    Un lote de ids se resuelve en una sola consulta (los ids van como un
+    array json en un unico parametro), asi el texto de la sentencia es
+    siempre el mismo y sqlite3 la reutiliza ya preparada.
+    Los resultados se guardan en una cache LRU de como mucho `maxsize` ids.
+    Las busquedas (search, filmography) solo devuelven ids, que luego
+    se resuelven con get_many
+    """
+
+    def __init__(self, db: DBlite, maxsize: int = 65536):
+        self.__db = db
+        self.__maxsize = maxsize
+        self.__cache: OrderedDict[str, Movie | object] = OrderedDict()
+        self.__lock = Lock()
+        self.__int_keys = is_int_keys(db)
+        self.__tables = set(db.to_tuple(
+            "select name from sqlite_master where type='table'"
+        ))
+        # las imdb.sqlite anteriores a MOVIE.title no tienen el titulo principal
+        self.__has_title = "title" in set(
+            c[1] for c in db.select(f"pragma table_info({self.__phys('MOVIE')})")
+        )
+        self.__sql = self.__build_sql()
+        self.__sql_filmography = self.__build_sql_filmography()
+        self.__sql_search = self.__build_sql_search()
+
+    def __phys(self, table: str):
+        # con claves enteras se consulta a las tablas _INT para que
+        # se usen sus claves primarias, las vistas no tienen indices
+        if self.__int_keys and table + INT_SUFFIX in self.__tables:
+            return table + INT_SUFFIX
+        return table
+
+    def __enc(self, table: str, col: str):
+        return to_int(PREFIX[table], col) if self.__int_keys else col
+
+    def __dec(self, table: str, col: str):
+        return to_txt(PREFIX[table], col) if self.__int_keys else col
+
+    def __build_sql(self):
+        if SEARCH_TABLE in self.__tables:
+            return (
+                f"select {', '.join(SEARCH_COLUMNS)} from {SEARCH_TABLE} "
+                "where id in (select value from json_each(?))"
+            )
+        key = self.__enc('MOVIE', "value")
+        return f"{self.select_sql()} where t.id in (select {key} from json_each(?))"
+
+    def select_sql(self):
+        """
+        Una fila por pelicula de MOVIE (alias t) con las columnas de SEARCH_COLUMNS
+        """
+        phys = self.__phys
+        cols = [
+            self.__dec('MOVIE', "t.id"), "t.title" if self.__has_title else "null",
+            "t.type", "t.year", "t.duration", "t.votes", "t.rating",
+            f"(select json_group_array(x.title) from (select title from {phys('TITLE')} where movie = t.id) x)",
+            f"(select json_group_array(x.name) from (select p.name from {phys('DIRECTOR')} d "
+            f"join {phys('PERSON')} p on p.id = d.person where d.movie = t.id order by p.name) x)",
+        ]
+        joins = ""
+        if phys('EXTRA') in self.__tables:
+            cols.extend(("e.filmaffinity", "e.wikipedia", "e.countries"))
+            joins = f" left join {phys('EXTRA')} e on e.movie = t.id"
+        else:
+            cols.extend(("null", "null", "null"))
+        return f"select {', '.join(cols)} from {phys('MOVIE')} t{joins}"
+
+    def __build_sql_filmography(self):
+        return (
+            f"select {self.__dec('MOVIE', 'd.movie')} from {self.__phys('DIRECTOR')} d "
+            f"join {self.__phys('MOVIE')} m on m.id = d.movie "
+            f"where d.person = {self.__enc('PERSON', '?')} "
+            "order by m.year desc, m.votes desc"
+        )
+
+    def __build_sql_search(self):
+        if FTS_TABLE in self.__tables:
+            return (
+                f"select {to_txt(PREFIX['MOVIE'], 'rowid')} from {FTS_TABLE} "
+                f"where {FTS_TABLE} match ? order by rank limit ?"
+            )
+        return (
+            f"select {self.__dec('MOVIE', 't.movie')} from {self.__phys('TITLE')} t "
+            f"join {self.__phys('MOVIE')} m on m.id = t.movie "
+            "where t.title like ? escape '\\' "
+            "group by t.movie order by max(m.votes) desc limit ?"
+        )
+
+    @staticmethod
+    def __to_movie(row: tuple):
+        id, title, typ, year, duration, votes, rating, titles, directors, film, wiki, countries = row
+        return Movie(
+            id=id,
+            title=title,
+            typ=typ,
+            year=year,
+            duration=duration,
+            votes=votes,
+            rating=rating,
+            titles=tuple(json.loads(titles)),
+            directors=tuple(json.loads(directors)),
+            filmaffinity=film,
+            wikipedia=wiki,
+            countries=tuple(countries.split()) if countries else tuple(),
+        )
+
+    def __remember(self, id: str, value: Movie | object):
+        self.__cache[id] = value
+        self.__cache.move_to_end(id)
+        while len(self.__cache) > self.__maxsize:
+            self.__cache.popitem(last=False)
+
+    def get_many(self, ids: Iterable[str]) -> dict[str, Movie]:
+        """
+        Peliculas de `ids` (en el mismo orden), los ids que no existen no aparecen
+        """
+        ids = tuple(dict.fromkeys(ids))
+        found: dict[str, Movie | object] = {}
+        with self.__lock:
+            for i in ids:
+                v = self.__cache.get(i)
+                if v is not None:
+                    self.__cache.move_to_end(i)
+                    found[i] = v
+        miss = tuple(i for i in ids if i not in found)
+        if miss:
+            for row in self.__db.select(self.__sql, json.dumps(miss)):
+                found[row[0]] = self.__to_movie(row)
+            with self.__lock:
+                for i in miss:
+                    self.__remember(i, found.setdefault(i, _MISSING))
+        return {i: found[i] for i in ids if found[i] is not _MISSING}
+
+    def get(self, id: str) -> Movie | None:
+        return self.get_many((id, )).get(id)
+
+    def filmography(self, person: str) -> tuple[str, ...]:
+        """
+        Peliculas dirigidas por `person`, de la mas reciente a la mas antigua
+        """
+        return self.__db.to_tuple(self.__sql_filmography, person)
+
+    def search(self, text: str, limit: int = 20) -> tuple[str, ...]:
+        """
+        Peliculas con algun titulo que contiene `text`. Si existe el indice
+        de texto completo (ver core.search) se busca por palabras, sin tener
+        en cuenta tildes ni mayusculas, y se ordena por relevancia (bm25).
+        Si no, se busca el texto tal cual y salen primero las mas votadas
+        """
+        text = text.strip()
+        if len(text) == 0:
+            return tuple()
+        if FTS_TABLE in self.__tables:
+            match = to_match(text)
+            if match is None:
+                return tuple()
+            return self.__db.to_tuple(self.__sql_search, match, limit)
+        like = "%" + re_like.sub(r"\\\g<0>", text) + "%"
+        return self.__db.to_tuple(self.__sql_search, like, limit)
+
+    def clear(self):
+        with self.__lock:
+            self.__cache.clear()
+
+    def __len__(self):
+        return len(self.__cache)
+
+
+def build_movie_search(db: DBlite):
+    """
+    (Re)crea SEARCH_TABLE a partir de MOVIE, TITLE, DIRECTOR, PERSON y EXTRA,
+    asi que hay que lanzarlo despues de complete.py
+    """
+    start = perf_counter()
+    select = MovieRepository(db, maxsize=0).select_sql()
+    db.executescript(FM.load("sql/movie_search.sql"))
+    db.execute(
+        f"INSERT INTO {SEARCH_TABLE} ({', '.join(SEARCH_COLUMNS)}) {select} ORDER BY 1",
+        log_level=logging.INFO
+    )
+    for name, cols in SEARCH_INDEXES.items():
+        db.execute(
+            f"CREATE INDEX {SEARCH_TABLE}_{name} ON {SEARCH_TABLE}({', '.join(cols)})",
+            log_level=logging.INFO
+        )
+    db.execute(f"ANALYZE {SEARCH_TABLE}")
+    db.commit()
+    count = db.to_tuple(f"select count(*) from {SEARCH_TABLE}")[0]
+    logger.info(f"{SEARCH_TABLE}: {count} peliculas en {perf_counter() - start:.1f}s")
@@ -4,9 +4,6 @@ from socket import timeout
 from functools import cache, cached_property
 import logging
 import json
-import gzip
-from io import TextIOWrapper
-import csv
 from http.client import HTTPResponse
 from time import sleep
 from json.decoder import JSONDecodeError
@@ -75,20 +72,5 @@ class Req:
                 logger.warning(f"{url} {str(e)}")
             return None
 
-    def iter_tsv(self, url: str):
-        with urlopen(url) as r:
-            with gzip.GzipFile(fileobj=r) as gz:
-                stream = TextIOWrapper(
-                    gz,
-                    encoding='utf-8',
-                    newline=''
-                )
-                reader = csv.reader(
-                    stream,
-                    delimiter='\t',
-                    quoting=csv.QUOTE_NONE
-                )
-                yield from reader
-
 
 R = Req()
@@ -0,0 +1,246 @@
+from core.dblite import DBlite
+from time import perf_counter
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Tablas cuyo id es un tconst/nconst y el prefijo que se quita al pasarlo a entero
+PREFIX = {
+    'MOVIE': 'tt',
+    'PERSON': 'nm',
+}
+INT_SUFFIX = "_INT"
+# Indices inversos (opcionales) de las tablas de clave compuesta,
+# al ser tablas WITHOUT ROWID el indice ya incluye la clave y es de cobertura
+REVERSE_INDEX = {
+    'DIRECTOR': ('person', 'movie'),
+}
+
+
+def id_to_int(id: str) -> int:
+    return int(id[2:])
+
+
+def to_int(prefix: str, col: str):
+    return f"CAST(substr({col}, {len(prefix) + 1}) AS INTEGER)"
+
+
+def to_txt(prefix: str, col: str):
+    return f"CASE WHEN {col} IS NULL THEN NULL ELSE printf('{prefix}%07d', {col}) END"
+
+
+def is_int_keys(db: DBlite):
+    return len(db.to_tuple(
+        "select name from sqlite_master where type='table' and name=?",
+        'MOVIE' + INT_SUFFIX
+    )) > 0
+
+
+def create_reverse_indexes(db: DBlite):
+    for table, cols in REVERSE_INDEX.items():
+        db.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_{cols[0].upper()} ON {table}({', '.join(cols)})",
+            log_level=logging.INFO
+        )
+
+
+def drop_table(db: DBlite, table: str):
+    """
+    Borra `table` sea cual sea su disposicion (tabla o vista + tabla _INT)
+    """
+    for name, tp in tuple(db.select(
+        "select name, type from sqlite_master where name in (?, ?) and type in ('table', 'view')",
+        table,
+        table + INT_SUFFIX
+    )):
+        db.execute(f"DROP {tp.upper()} {name}")
+
+
+class IntTable:
+    """
+    Describe como pasar una tabla con ids de IMDb en texto
+    (tt0000001, nm0000001) a una tabla {table}_INT con esos ids como enteros
+    """
+
+    def __init__(self, db: DBlite, table: str):
+        self.table = table
+        self.int_table = table + INT_SUFFIX
+        sql = db.to_tuple("select sql from sqlite_master where type='table' and name=?", table)[0]
+        self.without_rowid = re.search(r"\bWITHOUT\s+ROWID\s*$", sql.strip().rstrip(";"), re.I) is not None
+        # cid, name, type, notnull, dflt_value, pk
+        self.columns = tuple(db.select(f"pragma table_info({table})"))
+        # id, seq, table, from, to, ...
+        self.fks = tuple(db.select(f"pragma foreign_key_list({table})"))
+        self.pk = tuple(c[1] for c in sorted(self.columns, key=lambda c: c[5]) if c[5] > 0)
+        self.indexes = db.to_tuple(
+            "select sql from sqlite_master where type='index' and tbl_name=? and sql is not null",
+            table
+        )
+        self.prefix: dict[str, str] = {}
+        if table in PREFIX and len(self.pk) == 1:
+            self.prefix[self.pk[0]] = PREFIX[table]
+        # columnas NOT NULL que apuntan a MOVIE o PERSON: la vista saca el id
+        # en texto de la tabla referenciada, que tiene su indice (ver text_index_sql)
+        notnull = set(c[1] for c in self.columns if c[3])
+        self.refs: dict[str, tuple[str, str]] = {}
+        for fk in self.fks:
+            if fk[2] in PREFIX:
+                self.prefix[fk[3]] = PREFIX[fk[2]]
+                if fk[3] in notnull:
+                    self.refs[fk[3]] = (fk[2] + INT_SUFFIX, fk[4])
+
+    @property
+    def names(self):
+        return tuple(c[1] for c in self.columns)
+
+    def create_sql(self):
+        lines = []
+        rowid_pk = len(self.pk) == 1 and self.pk[0] in self.prefix and not self.without_rowid
+        for _, name, tp, notnull, dflt, pk in self.columns:
+            if name in self.prefix:
+                tp = "INTEGER"
+            line = f"{name} {tp}".strip()
+            if rowid_pk and pk:
+                line = line + " PRIMARY KEY"
+            if notnull:
+                line = line + " NOT NULL"
+            if dflt is not None:
+                line = line + f" DEFAULT {dflt}"
+            lines.append(line)
+        if self.pk and not rowid_pk:
+            lines.append(f"PRIMARY KEY ({', '.join(self.pk)})")
+        for fk in self.fks:
+            ref = fk[2] + INT_SUFFIX if fk[2] in PREFIX else fk[2]
+            lines.append(f"FOREIGN KEY ({fk[3]}) REFERENCES {ref}({fk[4]})")
+        sql = f"CREATE TABLE {self.int_table} (\n    " + ",\n    ".join(lines) + "\n)"
+        if self.without_rowid:
+            sql = sql + " WITHOUT ROWID"
+        return sql
+
+    def __enc(self, name: str, src: str):
+        if name in self.prefix:
+            return to_int(self.prefix[name], src)
+        return src
+
+    def __dec(self, name: str):
+        if name in self.prefix:
+            return f"{to_txt(self.prefix[name], 't.' + name)} AS {name}"
+        return "t." + name
+
+    def copy_sql(self):
+        names = ", ".join(self.names)
+        vals = ", ".join(self.__enc(n, n) for n in self.names)
+        sql = f"INSERT INTO {self.int_table} ({names}) SELECT {vals} FROM {self.table}"
+        if self.pk:
+            sql = sql + f" ORDER BY {', '.join(self.__enc(n, n) for n in self.pk)}"
+        return sql
+
+    def index_sql(self):
+        for sql in self.indexes:
+            yield re.sub(
+                r"\bON\s+" + re.escape(self.table) + r"\s*\(",
+                f"ON {self.int_table}(",
+                sql,
+                count=1,
+                flags=re.I
+            )
+
+    def text_index_sql(self):
+        """
+        Indices sobre el id en texto tal cual lo calcula la vista (sqlite usa
+        un indice de expresion si la expresion es la misma) para que los filtros
+        y joins por id contra las vistas no sean un recorrido completo:
+        el del propio id (MOVIE, PERSON), que tambien usan las vistas de las
+        tablas que los referencian, y el de las foreign keys que admiten NULL
+        """
+        for name in self.names:
+            if name in self.prefix and name not in self.refs:
+                yield (
+                    f"CREATE INDEX {self.int_table}_{name.upper()}_TXT "
+                    f"ON {self.int_table}({to_txt(self.prefix[name], name)})"
+                )
+
+    def view_sql(self):
+        cols = []
+        joins = []
+        for name in self.names:
+            if name not in self.refs:
+                cols.append(self.__dec(name))
+                continue
+            ref, ref_col = self.refs[name]
+            alias = f"r{len(joins)}"
+            cols.append(f"{to_txt(self.prefix[name], alias + '.' + ref_col)} AS {name}")
+            joins.append(f" JOIN {ref} {alias} ON {alias}.{ref_col} = t.{name}")
+        return f"CREATE VIEW {self.table} AS SELECT {', '.join(cols)} FROM {self.int_table} t{''.join(joins)}"
+
+    def trigger_sql(self):
+        """
+        Triggers INSTEAD OF para que los INSERT/UPDATE/DELETE
+        sobre la vista sigan funcionando con los ids en texto
+        """
+        defaults = {c[1]: c[4] for c in self.columns}
+
+        def new_val(n: str):
+            v = self.__enc(n, f"NEW.{n}")
+            if defaults[n] is not None:
+                v = f"coalesce({v}, {defaults[n]})"
+            return v
+
+        names = ", ".join(self.names)
+        vals = ", ".join(map(new_val, self.names))
+        yield (
+            f"CREATE TRIGGER {self.table}_INSERT INSTEAD OF INSERT ON {self.table} BEGIN "
+            f"INSERT INTO {self.int_table} ({names}) VALUES ({vals}); END"
+        )
+        if not self.pk:
+            return
+        where = " AND ".join(f"{n} = {self.__enc(n, 'OLD.' + n)}" for n in self.pk)
+        sets = ", ".join(f"{n} = {new_val(n)}" for n in self.names)
+        yield (
+            f"CREATE TRIGGER {self.table}_UPDATE INSTEAD OF UPDATE ON {self.table} BEGIN "
+            f"UPDATE {self.int_table} SET {sets} WHERE {where}; END"
+        )
+        yield (
+            f"CREATE TRIGGER {self.table}_DELETE INSTEAD OF DELETE ON {self.table} BEGIN "
+            f"DELETE FROM {self.int_table} WHERE {where}; END"
+        )
+
+
+def to_int_keys(db: DBlite):
+    """
+    Pasa a la disposicion de claves enteras todas las tablas que tengan ids
+    de IMDb (propios o como foreign key): cada tabla T se copia a T_INT con
+    los ids como INTEGER (el id de MOVIE y PERSON pasa a ser el rowid)
+    y T se sustituye por una vista con los ids en texto de siempre.
+    El id en texto solo se indexa en MOVIE_INT y PERSON_INT, las vistas del
+    resto lo sacan de ahi con un join, asi que solo se guarda una vez
+    (ver bench.py keys)
+    """
+    db.flush()
+    tables = db.to_tuple(
+        "select name from sqlite_master where type='table' and name not like 'sqlite%' and sql not like 'CREATE VIRTUAL%'"
+    )
+    todo: list[IntTable] = []
+    for t in tables:
+        if t.endswith(INT_SUFFIX) or t + INT_SUFFIX in tables:
+            continue
+        it = IntTable(db, t)
+        if it.prefix:
+            todo.append(it)
+    # primero las tablas referenciadas
+    todo.sort(key=lambda t: t.table not in PREFIX)
+    for it in todo:
+        start = perf_counter()
+        db.execute(it.create_sql())
+        db.execute(it.copy_sql(), log_level=logging.INFO)
+        db.execute(f"DROP TABLE {it.table}")
+        for sql in it.index_sql():
+            db.execute(sql, log_level=logging.INFO)
+        for sql in it.text_index_sql():
+            db.execute(sql, log_level=logging.INFO)
+        db.execute(it.view_sql())
+        for sql in it.trigger_sql():
+            db.execute(sql)
+        db.commit()
+        logger.info(f"{it.table} -> {it.int_table} en {perf_counter() - start:.1f}s")
@@ -0,0 +1,76 @@
+from core.dblite import DBlite
+from core.schema import PREFIX, INT_SUFFIX, is_int_keys, to_int
+from time import perf_counter
+import unicodedata
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# indice de texto completo de los titulos: una fila por pelicula
+# (todos sus titulos separados por saltos de linea) con la parte
+# numerica del tconst como rowid. Es contentless (content='') asi
+# que solo ocupa el indice, el texto sigue estando en TITLE
+FTS_TABLE = "TITLE_FTS"
+# el tokenizador ya pasa a minusculas y quita tildes (ñ -> n, é -> e)
+TOKENIZE = "unicode61 remove_diacritics 2"
+
+re_word = re.compile(r"\w+")
+
+
+def normalize(text: str):
+    """
+    Texto en minusculas y sin tildes, igual que lo deja el tokenizador:
+    lower() y no casefold(), que cambiaria ß por ss y no coincidiria
+    con lo indexado
+    """
+    text = unicodedata.normalize("NFD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def to_match(text: str) -> str | None:
+    """
+    Pasa lo que escribe el usuario a una consulta MATCH de fts5:
+    todas las palabras entre comillas (para que no se interpreten
+    como operadores) y la ultima como prefijo
+    """
+    words = re_word.findall(normalize(text))
+    if len(words) == 0:
+        return None
+    words = [f'"{w}"' for w in words]
+    words[-1] = words[-1] + "*"
+    return " ".join(words)
+
+
+def has_fts5(db: DBlite):
+    return "ENABLE_FTS5" in db.to_tuple("pragma compile_options")
+
+
+def has_title_index(db: DBlite):
+    return len(db.to_tuple(
+        "select name from sqlite_master where type='table' and name=?",
+        FTS_TABLE
+    )) > 0
+
+
+def build_title_index(db: DBlite):
+    """
+    (Re)crea FTS_TABLE a partir de TITLE, sea cual sea su disposicion
+    """
+    if not has_fts5(db):
+        logger.warning(f"sqlite {db.to_tuple('select sqlite_version()')[0]} sin fts5, no se crea {FTS_TABLE}")
+        return
+    start = perf_counter()
+    db.flush()
+    db.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    db.execute(
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, content='', tokenize='{TOKENIZE}')"
+    )
+    if is_int_keys(db):
+        select = f"SELECT movie, group_concat(title, char(10)) FROM TITLE{INT_SUFFIX} GROUP BY movie"
+    else:
+        select = f"SELECT {to_int(PREFIX['MOVIE'], 'movie')}, group_concat(title, char(10)) FROM TITLE GROUP BY movie"
+    db.execute(f"INSERT INTO {FTS_TABLE}(rowid, title) {select}", log_level=logging.INFO)
+    db.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    db.commit()
+    logger.info(f"{FTS_TABLE} creado en {perf_counter() - start:.1f}s")
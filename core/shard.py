@@ -0,0 +1,30 @@
+from multiprocessing import get_context, get_all_start_methods
+from typing import Any, Callable
+from time import perf_counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+_FORK = get_context("fork") if "fork" in get_all_start_methods() else None
+
+
+def run_forked(jobs: dict[str, Callable[[], Any]]):
+    """
+    Ejecuta cada job en su propio proceso (fork, para que hereden
+    el estado ya cargado) y espera a que acaben todos.
+    Si no hay fork se ejecutan uno detras de otro en este proceso
+    """
+    start = perf_counter()
+    if _FORK is None or len(jobs) < 2:
+        for fn in jobs.values():
+            fn()
+        return
+    procs = {k: _FORK.Process(target=fn, name=k) for k, fn in jobs.items()}
+    for p in procs.values():
+        p.start()
+    for k, p in procs.items():
+        p.join()
+        logger.info(f"{k} terminado en {perf_counter() - start:.1f}s (exitcode={p.exitcode})")
+    ko = tuple(k for k, p in procs.items() if p.exitcode != 0)
+    if ko:
+        raise RuntimeError(f"Han fallado: {', '.join(ko)}")
@@ -1,84 +1,430 @@
 import csv
+import gzip
 import logging
 import sys
-from typing import Any
+from os import cpu_count
+from io import StringIO
+from pathlib import Path
+from typing import Any, Callable, Iterable
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, Future
+from multiprocessing import get_context, get_all_start_methods
+from queue import Queue, Full
+from threading import Thread, Event, Lock
 import re
-from core.req import R
+from core.dataset import DS
+from core.columnar import ColumnCache, file_sha256
+from core.filemanager import FM
+from core.util import get_env
 
 logger = logging.getLogger(__name__)
 
 
 csv.field_size_limit(sys.maxsize)
 
+BLOCK_SIZE = 4 * 1024 * 1024
+# con 1 o 2 cpus no compensa repartir los bloques entre procesos,
+# el proceso principal (que tambien escribe en sqlite) ya ocupa una
+_CPUS = cpu_count() or 1
+WORKERS = int(get_env('TSV_WORKERS', default=str(_CPUS - 1 if _CPUS > 2 else 1)))
+# solo una lectura a la vez usa procesos (las demas, por ejemplo las de
+# merge_join, se decodifican en este proceso) asi nunca hay mas de WORKERS
+_POOL = Lock()
+_FORK = get_context("fork") if "fork" in get_all_start_methods() else None
+_CACHE = ColumnCache(get_env('TSV_CACHE')) if get_env('TSV_CACHE') else None
+
+re_list = re.compile(r'\s*,\s*')
+
 
 class KeyValueError(ValueError):
     def __init__(self, k: str, v):
         super().__init__(f"{k} = {v}")
 
 
-def _parse_val(kv: tuple[str, Any]):
-    k, v = kv
-    try:
-        return _parse_key_val(k, v)
-    except ValueError as e:
-        raise KeyValueError(k, v) from e
+def _to_str(v: str):
+    v = v.strip()
+    if v in ('', '\\N'):
+        return None
+    return v
 
 
-def _parse_key_val(k: str, v: Any):
-    if isinstance(v, str):
-        v = v.strip()
-    if v in ('', '\\N'):
-        v = None
+def _to_int(v: str):
+    v = _to_str(v)
     if v is None:
-        if k in ('numVotes', 'averageRating'):
-            return 0
-        if k in ('directors', 'writers'):
-            return tuple()
         return None
-    if k in ('isOriginalTitle', ):
-        if v not in ('0', '1', 1, 0, True, False):
-            raise KeyValueError(f"{k} = {v}")
-        return int(v) == 1
-    if not isinstance(v, str):
-        return v
-    if k in ('directors', 'writers'):
-        return tuple(re.split(r'\s*,\s*', v))
-    if k in ('averageRating', ):
-        return float(v)
-    if k in ('numVotes', 'ordering', 'startYear', 'endYear', 'runtimeMinutes'):
-        return int(v)
-    return v
+    return int(v)
 
 
-def iter_list(url: str):
-    logger.info(url)
-    reader = R.iter_tsv(url)
-    header = tuple(next(reader))
-    logger.info(", ".join(map(str, header)))
-    yield header
-    for row in reader:
-        kvs = zip(header, row)
+def _to_zero_int(v: str):
+    v = _to_str(v)
+    if v is None:
+        return 0
+    return int(v)
+
+
+def _to_zero_float(v: str):
+    v = _to_str(v)
+    if v is None:
+        return 0
+    return float(v)
+
+
+def _to_bool(v: str):
+    v = _to_str(v)
+    if v is None:
+        return None
+    if v not in ('0', '1'):
+        raise ValueError(v)
+    return v == '1'
+
+
+def _to_list(v: str):
+    v = _to_str(v)
+    if v is None:
+        return tuple()
+    return tuple(re_list.split(v))
+
+
+CONVERTERS: dict[str, Callable[[str], Any]] = {
+    'numVotes': _to_zero_int,
+    'averageRating': _to_zero_float,
+    'directors': _to_list,
+    'writers': _to_list,
+    'isOriginalTitle': _to_bool,
+    'ordering': _to_int,
+    'startYear': _to_int,
+    'endYear': _to_int,
+    'runtimeMinutes': _to_int,
+}
+
+
+KINDS: dict[Callable[[str], Any], str] = {
+    _to_str: 'str',
+    _to_int: 'int',
+    _to_zero_int: 'int',
+    _to_zero_float: 'float',
+    _to_bool: 'bool',
+    _to_list: 'list',
+}
+
+
+def get_converter(k: str) -> Callable[[str], Any]:
+    return CONVERTERS.get(k, _to_str)
+
+
+class Projection:
+    """
+    Decodificador de filas que solo convierte las columnas pedidas.
+    La cabecera se resuelve una vez y se compila una funcion
+    equivalente a `lambda row: (c0(row[i0]), c1(row[i1]), ...)`
+
+    Si se da `where` se llama antes de convertir nada, con los valores
+    en crudo (str tal cual vienen en el tsv, `\\N` incluido) de las
+    columnas `where_cols`, y las filas que no lo cumplen se decodifican a None
+    """
+
+    def __init__(
+        self,
+        header: tuple[str, ...],
+        columns: tuple[str, ...],
+        where: Callable[..., bool] = None,
+        where_cols: tuple[str, ...] = None
+    ):
+        index = {k: i for i, k in enumerate(header)}
+        where_cols = tuple(where_cols or tuple())
+        for c in columns + where_cols:
+            if c not in index:
+                raise KeyError(f"{c} no está en {', '.join(header)}")
+        self.columns = tuple(columns)
+        self.index = tuple(index[c] for c in self.columns)
+        self.converters = tuple(map(get_converter, self.columns))
+        self.where = where
+        self.where_cols = where_cols
+        body = "".join(f"c{n}(row[{i}]), " for n, i in enumerate(self.index))
+        scope = {f"c{n}": c for n, c in enumerate(self.converters)}
+        if where is None:
+            code = f"lambda row: ({body})"
+        else:
+            cond = ", ".join(f"row[{index[c]}]" for c in where_cols)
+            code = f"lambda row: ({body}) if where({cond}) else None"
+            scope['where'] = where
+        self.decode: Callable[[list[str]], tuple | None] = eval(code, scope)
+
+    def explain(self, row: list[str], e: Exception) -> Exception:
+        for k, i, c in zip(self.columns, self.index, self.converters):
+            try:
+                c(row[i])
+            except (ValueError, IndexError):
+                return KeyValueError(k, row[i] if i < len(row) else None)
+        return e
+
+
+def get_path(source: str | Path) -> Path:
+    """
+    Si `source` es una url se devuelve su copia local (ver core.dataset)
+    en otro caso se entiende que ya es la ruta a un fichero local
+    """
+    if isinstance(source, str) and re.match(r"^https?://", source):
+        return DS.get(source)
+    return FM.resolve_path(source)
+
+
+def _iter_blocks(path: Path, size: int = BLOCK_SIZE):
+    """
+    Lee (y descomprime) el fichero en bloques de lineas completas
+    """
+    f = gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")
+    with f:
+        rest = b''
+        while True:
+            data = f.read(size)
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                rest = data
+                continue
+            rest = data[cut:]
+            yield data[:cut]
+        if rest:
+            yield rest
+
+
+def _iter_reader(block: bytes):
+    return csv.reader(
+        StringIO(block.decode('utf-8'), newline=''),
+        delimiter='\t',
+        quoting=csv.QUOTE_NONE
+    )
+
+
+def _decode_block(prj: Projection, block: bytes) -> list[tuple]:
+    decode = prj.decode
+    arr = []
+    for row in _iter_reader(block):
+        try:
+            vals = decode(row)
+        except (ValueError, IndexError) as e:
+            raise ValueError(str(row)) from prj.explain(row, e)
+        if vals is not None:
+            arr.append(vals)
+    return arr
+
+
+_WORKER_PRJ: Projection = None
+
+
+def _init_worker(prj: Projection):
+    global _WORKER_PRJ
+    _WORKER_PRJ = prj
+
+
+def _decode_worker(block: bytes):
+    return _decode_block(_WORKER_PRJ, block)
+
+
+def _put(q: Queue, item, stop: Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _inflate(blocks, q: Queue, stop: Event):
+    try:
+        for b in blocks:
+            if not _put(q, b, stop):
+                return
+        _put(q, None, stop)
+    except BaseException as e:
+        _put(q, e, stop)
+
+
+def _iter_serial(prj: Projection, first: bytes, blocks):
+    yield from _decode_block(prj, first)
+    for b in blocks:
+        yield from _decode_block(prj, b)
+
+
+def _iter_parallel(prj: Projection, first: bytes, blocks, workers: int):
+    """
+    Un hilo descomprime, `workers` procesos parsean y convierten los bloques,
+    y los resultados se devuelven en el mismo orden que en el fichero
+    """
+    stop = Event()
+    q = Queue(maxsize=workers * 2)
+    pending: deque[Future] = deque()
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=_FORK,
+        initializer=_init_worker,
+        initargs=(prj, )
+    ) as pool:
+        # con fork el primer submit arranca todos los procesos, antes del hilo
+        # que descomprime; el de core.dblite.AsyncWriter se para antes de cada fork
+        pending.append(pool.submit(_decode_worker, first))
+        th = Thread(target=_inflate, args=(blocks, q, stop), daemon=True)
+        th.start()
         try:
-            yield tuple(map(_parse_val, kvs))
-        except KeyValueError as e:
-            raise ValueError(str(row)) from e
+            eof = False
+            while pending or not eof:
+                while not eof and len(pending) < workers * 2:
+                    item = q.get()
+                    if item is None:
+                        eof = True
+                    elif isinstance(item, BaseException):
+                        raise item
+                    else:
+                        pending.append(pool.submit(_decode_worker, item))
+                if pending:
+                    yield from pending.popleft().result()
+        finally:
+            stop.set()
+            for f in pending:
+                f.cancel()
+            th.join()
+
+
+def _iter_rows(prj: Projection, first: bytes, blocks, workers: int):
+    if workers > 1 and _FORK is not None and _POOL.acquire(blocking=False):
+        try:
+            yield from _iter_parallel(prj, first, blocks, workers)
+        finally:
+            _POOL.release()
+        return
+    yield from _iter_serial(prj, first, blocks)
+
+
+@contextmanager
+def limit_workers(workers: int):
+    """
+    Limita, mientras dure el with, los procesos de cada lectura,
+    por ejemplo para repartir WORKERS entre varios procesos que leen a la vez
+    """
+    global WORKERS
+    old = WORKERS
+    WORKERS = max(1, min(WORKERS, workers))
+    try:
+        yield
+    finally:
+        WORKERS = old
+
+
+def _scan(
+    source: str | Path,
+    columns: tuple[str, ...] = None,
+    where: Callable[..., bool] = None,
+    where_cols: tuple[str, ...] = None,
+    workers: int = None
+):
+    if _CACHE is not None:
+        return _scan_cache(source, columns, where=where, where_cols=where_cols, workers=workers)
+    return _scan_file(source, columns, where=where, where_cols=where_cols, workers=workers)
+
+
+def _scan_cache(
+    source: str | Path,
+    columns: tuple[str, ...] = None,
+    where: Callable[..., bool] = None,
+    where_cols: tuple[str, ...] = None,
+    workers: int = None
+):
+    """
+    Igual que _scan_file pero leyendo de la cache columnar (ver core.columnar),
+    que se crea decodificando el fichero completo la primera vez
+    """
+    path = get_path(source)
+    sha = file_sha256(path)
+    cache = _CACHE.get(path, sha)
+    if cache is None:
+        full, rows = _scan_file(path, workers=workers)
+        kinds = tuple(KINDS[c] for c in full.converters)
+        cache = _CACHE.put(path, full.columns, kinds, rows, sha=sha)
+    if columns is None:
+        columns = cache.header
+    prj = Projection(cache.header, columns, where=where, where_cols=where_cols)
+    return prj, cache.iter_rows(prj.columns, where=prj.where, where_cols=prj.where_cols)
+
+
+def _scan_file(
+    source: str | Path,
+    columns: tuple[str, ...] = None,
+    where: Callable[..., bool] = None,
+    where_cols: tuple[str, ...] = None,
+    workers: int = None
+):
+    logger.info(str(source))
+    blocks = _iter_blocks(get_path(source))
+    line, _, first = next(blocks, b'').partition(b'\n')
+    header = tuple(next(_iter_reader(line)))
+    logger.info(", ".join(map(str, header)))
+    prj = Projection(header, header if columns is None else columns, where=where, where_cols=where_cols)
+    return prj, _iter_rows(prj, first, blocks, WORKERS if workers is None else workers)
+
+
+def iter_list(url: str | Path, workers: int = None):
+    prj, rows = _scan(url, workers=workers)
+    yield prj.columns
+    yield from rows
 
 
 def iter_tuples(
-    url: str,
+    url: str | Path,
     *args: str,
+    where: Callable[..., bool] = None,
+    where_cols: tuple[str, ...] = None,
+    workers: int = None
+):
+    prj, rows = _scan(url, args, where=where, where_cols=where_cols, workers=workers)
+    yield from rows
+
+
+def iter_dict(
+    url: str | Path,
+    where: Callable[..., bool] = None,
+    where_cols: tuple[str, ...] = None,
+    workers: int = None
 ):
-    rows = iter_list(url)
-    header = {k: i for i, k in enumerate(next(rows))}
-    index = tuple(header[a] for a in args)
+    prj, rows = _scan(url, where=where, where_cols=where_cols, workers=workers)
     for row in rows:
-        vals = tuple(map(lambda i: row[i], index))
-        yield vals
+        yield dict(zip(prj.columns, row))
 
 
-def iter_dict(url: str):
-    rows = iter_list(url)
-    header = next(rows)
+def _check_sorted(rows: Iterable[tuple], name: str):
+    last = None
     for row in rows:
-        obj = dict(zip(header, row))
-        yield obj
+        if last is not None and row[0] <= last:
+            raise ValueError(f"{name} no está ordenado: {row[0]} después de {last}")
+        last = row[0]
+        yield row
+
+
+def merge_join(left: Iterable[tuple], *right: Iterable[tuple]):
+    """
+    Cruza iteradores de tuplas ordenados por su primer campo, sin repetidos
+    y en orden de str (el de los tsv de IMDb por tconst).
+    Por cada fila de `left` devuelve (fila, fila_1, fila_2, ...)
+    donde fila_n es la fila de `right[n]` con la misma clave o None
+    """
+    rights = [_check_sorted(r, f"merge_join[{i}]") for i, r in enumerate(right, start=1)]
+    heads = None
+    for row in _check_sorted(left, "merge_join[0]"):
+        if heads is None:
+            # se empieza por `left` (el mas grande) para que sea
+            # la lectura que se queda con los procesos (ver _POOL)
+            heads = [next(r, None) for r in rights]
+        k = row[0]
+        out = [row]
+        for i, r in enumerate(rights):
+            h = heads[i]
+            while h is not None and h[0] < k:
+                h = next(r, None)
+            heads[i] = h
+            out.append(h if h is not None and h[0] == k else None)
+        yield tuple(out)
+
@@ -1,77 +1,295 @@
-from core.dblite import DBlite, gW
-from core.tsv import iter_tuples
+from core.dblite import DBlite
+from core.tsv import iter_tuples, merge_join, limit_workers, WORKERS
 import logging
 from core.filemanager import FM
 from core.config_log import config_log
 from core.imdb import IMDB
 from core.wiki import WIKI
-from os import environ
+from core.schema import to_int_keys, create_reverse_indexes
+from core.search import build_title_index
+from core.util import get_env
+from core.idset import IdSet
+from core.delta import DeltaTable, can_delta, stage_delta, apply_delta, read_sources, write_sources
+from core.dataset import DS
+from core.shard import run_forked
+from functools import partial
+from typing import Any, Callable
+from os import environ, remove
+import hashlib
+import json
 
 config_log("log/build_db.log")
 
 logger = logging.getLogger(__name__)
 
-DB = DBlite("imdb.sqlite", reload=True)
+BASICS_URL = "https://datasets.imdbws.com/title.basics.tsv.gz"
+RATINGS_URL = "https://datasets.imdbws.com/title.ratings.tsv.gz"
+CREW_URL = "https://datasets.imdbws.com/title.crew.tsv.gz"
+AKAS_URL = "https://datasets.imdbws.com/title.akas.tsv.gz"
+PRINCIPALS_URL = "https://datasets.imdbws.com/title.principals.tsv.gz"
+NAMES_URL = "https://datasets.imdbws.com/name.basics.tsv.gz"
 
+# con INCREMENTAL se parte de la imdb.sqlite anterior y solo se escribe lo que
+# cambia (si no ha cambiado ningun fichero, ni eso), y como no se regenera
+# entera no se usa el perfil bulk, que la dejaria corrupta si algo falla
+TABLES = ("MOVIE", "PERSON", "TITLE", "DIRECTOR", "WORKER")
+INCREMENTAL = get_env('INCREMENTAL') is not None and can_delta("imdb.sqlite", *TABLES)
+DB = DBlite("imdb.sqlite", reload=not INCREMENTAL, bulk=not INCREMENTAL, async_write=True)
+# con SHARDS cada lectura se hace en su propio proceso sobre su propia
+# base de datos, y despues se juntan todas en imdb.sqlite
+SHARDS = get_env('SHARDS') is not None
+# ids ya insertados en MOVIE y ids de PERSON a los que se hace referencia,
+# para descartar durante la lectura lo que luego sobraria
+MOVIES = IdSet("tt")
+PERSONS = IdSet("nm")
 
-def isOkTitle(isOriginalTitle: bool, language: str, region: str, *args):
-    if isOriginalTitle:
+
+def isOkTitle(isOriginalTitle: str, language: str, region: str):
+    if isOriginalTitle == '1':
         return True
-    if language is not None:
+    if language not in ('', '\\N'):
         return language in ('es', 'en')
     return region == 'ES'
 
 
+def isOkAka(titleId: str, isOriginalTitle: str, language: str, region: str):
+    return titleId in MOVIES and isOkTitle(isOriginalTitle, language, region)
+
+
+def isOkPerson(nconst: str, primaryName: str):
+    return nconst in PERSONS and isOkName(primaryName)
+
+
+def isOkType(titleType: str):
+    return titleType != 'videoGame'
+
+
+def isOkName(primaryName: str):
+    return primaryName.strip() not in ('', '\\N')
+
+
 def main():
-    DB.executescript(FM.load("sql/schema.sql"))
-    MAIN_MOVIES = populate_title_basic()
-    populate_title_akas()
-    populate_title_ratings(MAIN_MOVIES)
-    #  populate_title_crew(MAIN_MOVIES)
-    #  populate_names("WORKER")
-    populate_title_director(MAIN_MOVIES)
-    populate_names("DIRECTOR")
-    finish_clean("DIRECTOR")
-
-
-def populate_title_basic():
-    MAIN_MOVIES = set(IMDB.scrape(*environ.get('SCRAPE_URLS', '').split()))
+    MAIN_MOVIES = get_main_movies()
+    sources = get_sources(MAIN_MOVIES)
+    delta = tuple()
+    if INCREMENTAL:
+        if sources == read_sources(DB.file):
+            logger.info(f"Nada ha cambiado desde la ultima carga de {DB.file}")
+            return
+        delta = stage_delta(DB, *TABLES)
+    else:
+        DB.executescript(FM.load("sql/schema.sql"))
+        if get_env('REVERSE_INDEX'):
+            create_reverse_indexes(DB)
+        if not SHARDS:
+            stage_tables()
+    if SHARDS:
+        build_shards(MAIN_MOVIES)
+    else:
+        populate_movies(MAIN_MOVIES)
+        recover_movies(MAIN_MOVIES)
+        populate_title_akas(isOkAka, ('titleId', 'isOriginalTitle', 'language', 'region'))
+        populate_main_ratings(MAIN_MOVIES)
+        populate_main_director(MAIN_MOVIES)
+        populate_title_principals(MAIN_MOVIES)
+        populate_names(isOkPerson, ('nconst', 'primaryName'))
+    recover_names("DIRECTOR", "WORKER")
+    finish_clean(delta, sources)
+
+
+def get_main_movies():
+    MAIN_MOVIES = IdSet("tt", IMDB.scrape(*environ.get('SCRAPE_URLS', '').split()))
     logger.info(f"{len(MAIN_MOVIES)} MAIN_MOVIES")
     for id in MAIN_MOVIES:
         IMDB.get_from_omdbapi(id)
-    MISS_MOVIES = set(MAIN_MOVIES)
-
-    for row in iter_tuples(
-        'https://datasets.imdbws.com/title.basics.tsv.gz',
-        'tconst',
-        'titleType',
-        'startYear',
-        'runtimeMinutes',
-        'primaryTitle',
-        'originalTitle'
-    ):
-        if row[1] in ('videoGame', ):
-            continue
-        MISS_MOVIES.discard(row[0])
-        DB.executemany(
-            "INSERT INTO MOVIE (id, type, year, duration) VALUES (?, ?, ?, ?)",
-            row[:4]
-        )
-        for v in row[-2:]:
-            if v is not None:
+    return MAIN_MOVIES
+
+
+def get_sources(MAIN_MOVIES: IdSet):
+    """
+    Version de todo lo que se va a leer (ver core.delta.SOURCE_TABLE)
+    """
+    urls = (BASICS_URL, RATINGS_URL, CREW_URL, AKAS_URL, NAMES_URL)
+    if MAIN_MOVIES:
+        urls = urls + (PRINCIPALS_URL, )
+    sources = {u: DS.version(u) for u in urls}
+    sources['MAIN_MOVIES'] = hashlib.sha256("\n".join(MAIN_MOVIES).encode()).hexdigest()
+    return sources
+
+
+def stage_tables():
+    # TITLE, DIRECTOR y WORKER se rellenan con INSERT OR IGNORE
+    # (se repiten, por ejemplo, primaryTitle y originalTitle)
+    # pero en PERSON un id repetido es un error
+    DB.stage("TITLE", "DIRECTOR", "WORKER", on_conflict="IGNORE")
+    DB.stage("PERSON")
+
+
+def build_shard(file: str, workers: int, populate: Callable[..., Any], *args):
+    """
+    Ejecuta `populate` (en un proceso aparte) contra su propia base de datos
+    leyendo los tsv con como mucho `workers` procesos.
+    Sin fork (ver core.shard.run_forked) se ejecuta en este mismo proceso,
+    asi que al acabar se deja DB como estaba
+    """
+    global DB
+    main_db = DB
+    DB = DBlite(file, reload=True, quick_release=True, bulk=True, async_write=True)
+    try:
+        with limit_workers(workers):
+            DB.executescript(FM.load("sql/schema.sql"))
+            stage_tables()
+            populate(*args)
+        DB.close()
+    finally:
+        DB = main_db
+
+
+def build_shards(MAIN_MOVIES: IdSet):
+    """
+    Lee en paralelo, cada uno en su proceso y su base de datos,
+    title.basics/ratings/crew, title.akas, title.principals y name.basics.
+    Como cada proceso no sabe que peliculas o personas cargan los demas,
+    los filtros por id se hacen al juntarlos con INSERT ... SELECT
+    """
+    shards = {
+        'shard_movies': (populate_movies, MAIN_MOVIES),
+        'shard_akas': (populate_title_akas, isOkTitle, ('isOriginalTitle', 'language', 'region')),
+        'shard_principals': (populate_title_principals, MAIN_MOVIES),
+        'shard_names': (populate_names, isOkName, ('primaryName', )),
+    }
+    files = {k: f"{DB.file}.{k}" for k in shards}
+    # los shards leen a la vez, asi que se reparten los procesos de core.tsv
+    workers = WORKERS // len(shards)
+    run_forked({
+        k: partial(build_shard, files[k], workers, *args)
+        for k, args in shards.items()
+    })
+    for k, f in files.items():
+        DB.execute(f"ATTACH DATABASE ? AS {k}", f)
+    DB.execute(
+        "INSERT INTO MOVIE (id, title, type, year, duration, rating, votes) "
+        "SELECT id, title, type, year, duration, rating, votes FROM shard_movies.MOVIE ORDER BY id",
+        log_level=logging.INFO
+    )
+    DB.commit()
+    recover_movies(MAIN_MOVIES)
+    DB.execute(
+        "INSERT OR IGNORE INTO TITLE (movie, title) "
+        "SELECT movie, title FROM shard_movies.TITLE UNION "
+        "SELECT movie, title FROM shard_akas.TITLE WHERE movie in (select id from MOVIE) "
+        "ORDER BY 1, 2",
+        log_level=logging.INFO
+    )
+    DB.execute(
+        "INSERT OR IGNORE INTO DIRECTOR (movie, person) "
+        "SELECT movie, person FROM shard_movies.DIRECTOR ORDER BY 1, 2",
+        log_level=logging.INFO
+    )
+    DB.execute(
+        "INSERT OR IGNORE INTO WORKER (movie, person, category) "
+        "SELECT movie, person, category FROM shard_movies.WORKER UNION "
+        "SELECT movie, person, category FROM shard_principals.WORKER WHERE movie in (select id from MOVIE) "
+        "ORDER BY 1, 2, 3",
+        log_level=logging.INFO
+    )
+    DB.commit()
+    populate_main_ratings(MAIN_MOVIES)
+    populate_main_director(MAIN_MOVIES)
+    DB.execute(
+        "INSERT INTO PERSON (id, name) "
+        "SELECT id, name FROM shard_names.PERSON WHERE id in "
+        "(select person from DIRECTOR UNION select person from WORKER) ORDER BY id",
+        log_level=logging.INFO
+    )
+    DB.commit()
+    for k, f in files.items():
+        DB.execute(f"DETACH DATABASE {k}")
+        remove(f)
+
+
+def populate_movies(MAIN_MOVIES: IdSet):
+    """
+    Recorre a la vez title.basics, title.ratings y title.crew
+    (los tres ordenados por tconst) para insertar cada MOVIE completa,
+    con su valoracion, junto a sus titulos, directores
+    y (solo para MAIN_MOVIES) guionistas
+    """
+    def iter_movies():
+        for basic, rating, crew in merge_join(
+            iter_tuples(
+                BASICS_URL,
+                'tconst',
+                'titleType',
+                'startYear',
+                'runtimeMinutes',
+                'primaryTitle',
+                'originalTitle',
+                where=isOkType,
+                where_cols=('titleType', )
+            ),
+            iter_tuples(
+                RATINGS_URL,
+                'tconst',
+                'averageRating',
+                'numVotes'
+            ),
+            iter_tuples(
+                CREW_URL,
+                'tconst',
+                'directors',
+                'writers'
+            )
+        ):
+            tconst = basic[0]
+            MOVIES.add(tconst)
+            for v in basic[-2:]:
+                if v is not None:
+                    DB.executemany(
+                        "INSERT OR IGNORE INTO TITLE (movie, title) VALUES (?, ?)",
+                        (tconst, v)
+                    )
+            if crew is None:
+                crew = (tconst, tuple(), tuple())
+            for d in crew[1]:
+                PERSONS.add(d)
                 DB.executemany(
-                    "INSERT OR IGNORE INTO TITLE (movie, title) VALUES (?, ?)",
-                    (row[0], v)
+                    "INSERT OR IGNORE INTO DIRECTOR (movie, person) VALUES (?, ?)",
+                    (tconst, d)
                 )
+            if tconst in MAIN_MOVIES:
+                for w in crew[2]:
+                    PERSONS.add(w)
+                    DB.executemany(
+                        "INSERT OR IGNORE INTO WORKER (movie, person, category) VALUES (?, ?, ?)",
+                        (tconst, w, 'writer')
+                    )
+            yield (tconst, basic[4]) + basic[1:4] + (rating[1:] if rating else (0, 0))
+
+    DB.insert_rows("MOVIE", ("id", "title", "type", "year", "duration", "rating", "votes"), iter_movies())
+    DB.flush()
+
+
+def recover_movies(MAIN_MOVIES: IdSet):
+    """
+    Las MAIN_MOVIES que no estan en title.basics se piden a mano,
+    y las que no se consiguen se quitan de MAIN_MOVIES
+    """
+    if not MAIN_MOVIES:
+        return
+    MISS_MOVIES = MAIN_MOVIES.difference(
+        DB.to_tuple(f"select id from MOVIE where id in {DB.id_table('MAIN_MOVIES', MAIN_MOVIES)}")
+    )
     if len(MISS_MOVIES):
         logger.debug(f"{len(MISS_MOVIES)} películas necesitan recuperarse a mano")
         for v in map(IMDB.get, sorted(MISS_MOVIES)):
             if not v:
                 continue
             MISS_MOVIES.discard(v.id)
+            MOVIES.add(v.id)
             DB.executemany(
-                "INSERT INTO MOVIE (id, type, year, duration, votes, rating) VALUES (?, ?, ?, ?, ?, ?)",
-                (v.id, v.typ, v.year, v.duration, v.votes, v.rating)
+                "INSERT INTO MOVIE (id, title, type, year, duration, votes, rating) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (v.id, v.title, v.typ, v.year, v.duration, v.votes, v.rating)
             )
             if v.title:
                 DB.executemany(
@@ -82,179 +300,143 @@ def populate_title_basic():
     if len(MISS_MOVIES):
         logger.warning(f"{len(MISS_MOVIES)} películas no se han podido recuperar")
 
-    MAIN_MOVIES = tuple(sorted(MAIN_MOVIES.difference(MISS_MOVIES)))
-    return MAIN_MOVIES
+    MAIN_MOVIES.difference_update(MISS_MOVIES)
 
 
-def populate_title_akas():
-    for row in iter_tuples(
-        'https://datasets.imdbws.com/title.akas.tsv.gz',
-        'titleId',
-        'title',
-        'isOriginalTitle',
-        'language',
-        'region',
-    ):
-        if not isOkTitle(*row[2:]):
-            continue
-        DB.executemany(
-            "INSERT OR IGNORE INTO TITLE (movie, title) VALUES (?, ?)",
-            row[:2]
-        )
-    DB.flush()
-
-
-def populate_title_ratings(MAIN_MOVIES: tuple[str, ...]):
-    for row in iter_tuples(
-        "https://datasets.imdbws.com/title.ratings.tsv.gz",
-        'averageRating',
-        'numVotes',
-        'tconst',
-    ):
-        if row[1:] == (0, 0):
-            continue
-        DB.executemany(
-            "UPDATE MOVIE SET rating = ?, votes = ? where id = ?",
-            row
-        )
-    DB.flush()
-    if MAIN_MOVIES:
-        for v in map(
-            IMDB.get,
-            DB.to_tuple(f"select id from MOVIE where votes = 0 and id {gW(MAIN_MOVIES)}", *MAIN_MOVIES)
-        ):
-            if v and v.votes > 0 and v.rating > 0:
-                DB.executemany(
-                    "UPDATE MOVIE SET rating = ?, votes = ? where id = ?",
-                    (v.rating, v.votes, v.id)
-                )
-    DB.flush()
+def populate_title_akas(where: Callable[..., bool], where_cols: tuple[str, ...]):
+    DB.insert_rows(
+        "TITLE",
+        ("movie", "title"),
+        iter_tuples(
+            AKAS_URL,
+            'titleId',
+            'title',
+            where=where,
+            where_cols=where_cols
+        ),
+        on_conflict="IGNORE"
+    )
 
 
-def populate_title_director(MAIN_MOVIES: tuple[str, ...]):
-    for tconst, directors in iter_tuples(
-        "https://datasets.imdbws.com/title.crew.tsv.gz",
-        'tconst',
-        'directors',
+def populate_main_ratings(MAIN_MOVIES: IdSet):
+    if not MAIN_MOVIES:
+        return
+    for v in map(
+        IMDB.get,
+        DB.to_tuple(f"select id from MOVIE where votes = 0 and id in {DB.id_table('MAIN_MOVIES', MAIN_MOVIES)}")
     ):
-        for d in directors:
+        if v and v.votes > 0 and v.rating > 0:
             DB.executemany(
-                "INSERT OR IGNORE INTO DIRECTOR (movie, person) VALUES (?, ?)",
-                (tconst, d)
+                "UPDATE MOVIE SET rating = ?, votes = ? where id = ?",
+                (v.rating, v.votes, v.id)
             )
     DB.flush()
-    DB.commit()
-    if MAIN_MOVIES:
-        MISS_DIRECTOR = set(DB.to_tuple(
-            f"select id from movie where id in {MAIN_MOVIES+(-1, )} and id not in (select movie from DIRECTOR)"
-        ))
-        if MISS_DIRECTOR:
-            logger.debug(f"{len(MISS_DIRECTOR)} películas necesitan recuperar el director a mano")
-            for k, directors in WIKI.get_director(*sorted(MISS_DIRECTOR)).items():
-                MISS_DIRECTOR.discard(k)
-                for v in directors:
-                    DB.executemany(
-                        "INSERT OR IGNORE INTO DIRECTOR (movie, person) VALUES (?, ?)",
-                        (k, v)
-                    )
+
+
+def populate_main_director(MAIN_MOVIES: IdSet):
+    if not MAIN_MOVIES:
+        return
+    MISS_DIRECTOR = IdSet("tt", DB.to_tuple(
+        f"select id from movie where id in {DB.id_table('MAIN_MOVIES', MAIN_MOVIES)} and id not in (select movie from DIRECTOR)"
+    ))
+    if MISS_DIRECTOR:
+        logger.debug(f"{len(MISS_DIRECTOR)} películas necesitan recuperar el director a mano")
+        for k, directors in WIKI.get_director(*sorted(MISS_DIRECTOR)).items():
+            MISS_DIRECTOR.discard(k)
+            for v in directors:
+                # Wikidata no siempre da un nconst valido
+                if not PERSONS.add(v):
+                    continue
+                DB.executemany(
+                    "INSERT OR IGNORE INTO DIRECTOR (movie, person) VALUES (?, ?)",
+                    (k, v)
+                )
     DB.flush()
     if MISS_DIRECTOR:
         logger.warning(f"{len(MISS_DIRECTOR)} películas que no se ha podido recuperar el director")
 
 
-def populate_title_crew(MAIN_MOVIES: tuple[str, ...]):
-    for tconst, directors, writers in iter_tuples(
-        "https://datasets.imdbws.com/title.crew.tsv.gz",
-        'tconst',
-        'directors',
-        'writers'
-    ):
-        for d in directors:
-            DB.executemany(
-                "INSERT OR IGNORE INTO WORKER (movie, person, category) VALUES (?, ?, ?)",
-                (tconst, d, 'director')
-            )
+def populate_title_principals(MAIN_MOVIES: IdSet):
+    """
+    De title.principals solo interesan los primeros guionistas y actores
+    de MAIN_MOVIES, asi que se filtra sobre los campos en crudo
+    (primero el tconst, que descarta casi todo) y si no hay MAIN_MOVIES
+    ni siquiera se lee el fichero. Los directores ya estan en DIRECTOR
+    """
+    if not MAIN_MOVIES:
+        return
+
+    def isOkWorker(tconst: str, category: str, ordering: str):
         if tconst not in MAIN_MOVIES:
-            continue
-        for w in writers:
-            DB.executemany(
-                "INSERT OR IGNORE INTO WORKER (movie, person, category) VALUES (?, ?, ?)",
-                (tconst, w, 'writer')
-            )
-    DB.flush()
-    for tconst, nconst, category, ordering in iter_tuples(
-        "https://datasets.imdbws.com/title.principals.tsv.gz",
-        'tconst',
-        'nconst',
-        'category',
-        'ordering',
-    ):
-        if category != 'director':
-            if tconst not in MAIN_MOVIES or ordering > 10 or category not in ('writer', 'actor', 'actress'):
-                continue
-        DB.executemany(
-            "INSERT OR IGNORE INTO WORKER (movie, person, category) VALUES (?, ?, ?)",
-            (tconst, nconst, category)
-        )
-    DB.flush()
-    DB.commit()
-    if MAIN_MOVIES:
-        MISS_DIRECTOR = set(DB.to_tuple(
-            f"select id from movie where id in {MAIN_MOVIES+(-1, )} and id not in (select movie from WORKER where category='director')"
-        ))
-        if MISS_DIRECTOR:
-            logger.debug(f"{len(MISS_DIRECTOR)} películas necesitan recuperar el director a mano")
-            for k, directors in WIKI.get_director(*sorted(MISS_DIRECTOR)).items():
-                MISS_DIRECTOR.discard(k)
-                for v in directors:
-                    DB.executemany(
-                        "INSERT OR IGNORE INTO WORKER (movie, person, category) VALUES (?, ?, ?)",
-                        (k, v, 'director')
-                    )
-    DB.flush()
-    if MISS_DIRECTOR:
-        logger.warning(f"{len(MISS_DIRECTOR)} películas que no se ha podido recuperar el director")
+            return False
+        if category not in ('writer', 'actor', 'actress'):
+            return False
+        return int(ordering) <= 10
 
+    def iter_workers():
+        for row in iter_tuples(
+            PRINCIPALS_URL,
+            'tconst',
+            'nconst',
+            'category',
+            where=isOkWorker,
+            where_cols=('tconst', 'category', 'ordering')
+        ):
+            PERSONS.add(row[1])
+            yield row
 
-def populate_names(table_use_person: str):
-    for nconst, primaryName in iter_tuples(
-        'https://datasets.imdbws.com/name.basics.tsv.gz',
-        'nconst',
-        'primaryName',
-    ):
-        if primaryName is None:
-            continue
-        DB.executemany(
-            "INSERT INTO PERSON (id, name) values (?, ?)",
-            (nconst, primaryName)
-        )
-    DB.flush()
+    DB.insert_rows("WORKER", ("movie", "person", "category"), iter_workers(), on_conflict="IGNORE")
 
-    ids = DB.to_tuple(f"select distinct person from {table_use_person} where person not in (select id from PERSON)")
-    for row in IMDB.get_names(*ids).items():
-        DB.executemany(
-            "INSERT INTO PERSON (id, name) values (?, ?)",
-            row
+
+def populate_names(where: Callable[..., bool], where_cols: tuple[str, ...]):
+    DB.insert_rows(
+        "PERSON",
+        ("id", "name"),
+        iter_tuples(
+            NAMES_URL,
+            'nconst',
+            'primaryName',
+            where=where,
+            where_cols=where_cols
         )
+    )
+
+
+def recover_names(*tables_use_person: str):
+    """
+    Las personas de `tables_use_person` que no estan en name.basics se piden
+    a mano, y solo se borran las filas cuya persona no se ha podido recuperar
+    """
     DB.flush()
+    persons = " UNION ".join(f"select person from {t}" for t in tables_use_person)
+    MISS_PERSONS = IdSet("nm", DB.to_tuple(
+        f"select person from ({persons}) where person not in (select id from PERSON)"
+    ))
+    if not MISS_PERSONS:
+        return
+    names = IMDB.get_names(*sorted(MISS_PERSONS))
+    MISS_PERSONS.difference_update(names.keys())
+    DB.insert_rows("PERSON", ("id", "name"), names.items())
+    if MISS_PERSONS:
+        logger.warning(f"{len(MISS_PERSONS)} personas no se han podido recuperar")
+        for t in tables_use_person:
+            DB.execute(
+                f"DELETE FROM {t} where person in (select value from json_each(?))",
+                json.dumps(sorted(MISS_PERSONS)),
+                log_level=logging.INFO
+            )
 
 
-def finish_clean(table_use_person: str):
-    DB.commit()
-    for t in ('TITLE', ):
-        DB.execute(
-            f"DELETE FROM {t} where movie not in (select id from MOVIE)",
-            log_level=logging.INFO
-        )
-    DB.execute(
-        f"DELETE FROM {table_use_person} where movie not in (select id from MOVIE) OR person not in (select id from PERSON)",
-        log_level=logging.INFO
-    )
-    DB.execute(
-        f"DELETE FROM PERSON where id not in (select person from {table_use_person})",
-        log_level=logging.INFO
-    )
+def finish_clean(delta: tuple[DeltaTable, ...], sources: dict[str, str]):
+    DB.flush()
     DB.commit()
+    if delta:
+        apply_delta(DB, delta)
+    DB.unstage()
+    write_sources(DB, sources)
+    if get_env('INT_KEYS'):
+        to_int_keys(DB)
+    build_title_index(DB)
     DB.close()
 
 
@@ -0,0 +1,96 @@
+"""
+Prueba de carga de server.py a un ritmo fijo de peticiones
+
+    python3 loadtest.py [imdb.sqlite] [--url http://127.0.0.1:8000] [--rate 200] [--duration 10]
+
+Las peticiones se lanzan a su hora aunque las anteriores no hayan
+terminado, y la latencia se mide desde esa hora, asi que si el
+servidor no da abasto la espera en cola tambien cuenta
+"""
+from core.dblite import DBlite
+from bench import percentile
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from urllib.parse import quote
+from time import perf_counter, sleep
+import argparse
+import random
+import re
+
+SAMPLE = 2000
+# peso de cada tipo de peticion
+MIX = {
+    'movie': 6,
+    'search': 2,
+    'director': 2,
+}
+
+
+def get_paths(file: str, n: int):
+    db = DBlite(file, readonly=True)
+    movies = db.to_tuple(f"select id from MOVIE order by random() limit {SAMPLE}")
+    directors = db.to_tuple(f"select distinct person from DIRECTOR order by random() limit {SAMPLE}")
+    words = tuple(set(
+        w.lower()
+        for t in db.to_tuple(f"select title from TITLE order by random() limit {SAMPLE}")
+        for w in re.findall(r"\w{4,}", t)
+    ))
+    db.close()
+    kinds = random.choices(tuple(MIX.keys()), weights=tuple(MIX.values()), k=n)
+    for k in kinds:
+        if k == 'movie':
+            yield k, f"/movie/{random.choice(movies)}"
+        elif k == 'director':
+            yield k, f"/director/{random.choice(directors)}"
+        else:
+            yield k, f"/search?q={quote(random.choice(words))}"
+
+
+def fetch(url: str, due: float):
+    try:
+        with urlopen(url, timeout=30) as r:
+            r.read()
+            status = r.status
+    except HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, (perf_counter() - due) * 1000
+
+
+def run(file: str, url: str, rate: float, duration: float, workers: int):
+    paths = tuple(get_paths(file, int(rate * duration)))
+    futures = []
+    with ThreadPoolExecutor(workers) as pool:
+        start = perf_counter()
+        for i, (kind, path) in enumerate(paths):
+            due = start + i / rate
+            wait = due - perf_counter()
+            if wait > 0:
+                sleep(wait)
+            futures.append((kind, pool.submit(fetch, url.rstrip("/") + path, due)))
+        results = [(kind, f.result()) for kind, f in futures]
+    elapsed = perf_counter() - start
+    status = Counter(s for _, (s, _) in results)
+    times: dict[str, list[float]] = defaultdict(list)
+    for kind, (_, ms) in sorted(results, key=lambda r: r[0]):
+        times[kind].append(ms)
+    times['total'] = [ms for _, (_, ms) in results]
+    print(f"{len(results)} peticiones en {elapsed:.1f}s ({len(results) / elapsed:.0f}/s, objetivo {rate:.0f}/s)")
+    print("status: " + ", ".join(f"{k}={v}" for k, v in sorted(status.items())))
+    print(f"{'peticion':<10} {'n':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, t in times.items():
+        print(f"{kind:<10} {len(t):>6} {percentile(t, 0.5):>8.2f} {percentile(t, 0.99):>8.2f} {max(t):>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de server.py")
+    parser.add_argument("db", nargs="?", default="imdb.sqlite", help="de donde sacar los ids a pedir")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", type=float, default=200, help="peticiones por segundo")
+    parser.add_argument("--duration", type=float, default=10, help="segundos")
+    parser.add_argument("--workers", type=int, default=64)
+    args = parser.parse_args()
+    run(args.db, args.url, args.rate, args.duration, args.workers)
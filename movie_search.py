@@ -0,0 +1,14 @@
+from core.dblite import DBlite
+from core.config_log import config_log
+from core.repository import build_movie_search
+import logging
+
+config_log("log/movie_search_db.log")
+
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    DB = DBlite("imdb.sqlite", quick_release=True)
+    build_movie_search(DB)
+    DB.close()
@@ -0,0 +1,18 @@
+from core.dblite import DBlite
+from core.config_log import config_log
+from core.ratings import refresh_ratings
+from core.imdb import IMDB
+from os import environ
+import logging
+
+config_log("log/ratings_db.log")
+
+logger = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    DB = DBlite("imdb.sqlite", quick_release=True)
+    # las MAIN_MOVIES que no estan en title.ratings conservan la valoracion de OMDb
+    MAIN_MOVIES = IMDB.scrape(*environ.get('SCRAPE_URLS', '').split())
+    refresh_ratings(DB, keep=MAIN_MOVIES)
+    DB.close()
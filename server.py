@@ -0,0 +1,183 @@
+"""
+Servicio HTTP (solo lectura) sobre una imdb.sqlite ya construida
+
+    python3 server.py [imdb.sqlite] [--port 8000]
+
+    GET /movie/tt0000001
+    GET /search?q=el señor de los anillos&limit=20
+    GET /director/nm0000001
+"""
+from core.dblite import DBlite
+from core.repository import MovieRepository
+from core.config_log import config_log
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+import argparse
+import hashlib
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+re_movie = re.compile(r"^/movie/(tt\d+)/?$")
+re_director = re.compile(r"^/director/(nm\d+)/?$")
+MAX_LIMIT = 100
+
+
+class TTLCache:
+    """
+    Respuestas ya generadas, cada una caduca a los `ttl` segundos
+    y como mucho se guardan `maxsize` (se tiran primero las mas antiguas)
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.__ttl = ttl
+        self.__maxsize = maxsize
+        self.__data: OrderedDict[str, tuple[float, tuple]] = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key: str):
+        with self.__lock:
+            v = self.__data.get(key)
+            if v is None:
+                return None
+            if v[0] < monotonic():
+                del self.__data[key]
+                return None
+            return v[1]
+
+    def set(self, key: str, value: tuple):
+        with self.__lock:
+            self.__data[key] = (monotonic() + self.__ttl, value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.__maxsize:
+                self.__data.popitem(last=False)
+
+
+class PoolHTTPServer(HTTPServer):
+    """
+    Atiende las peticiones con un numero fijo de hilos, asi cada hilo
+    reutiliza su conexion de solo lectura (ver DBlite readonly)
+    en vez de abrir una por peticion
+    """
+
+    def __init__(self, *args, workers: int = 8, **kwargs):
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="http")
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.__process, request, client_address)
+
+    def __process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    repo: MovieRepository = None
+    cache: TTLCache = None
+    max_age: int = 0
+
+    def log_message(self, format: str, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        resp = self.cache.get(self.path)
+        if resp is None:
+            resp = self.__response()
+            if resp[0] == 200:
+                self.cache.set(self.path, resp)
+        status, etag, body = resp
+        if etag is not None and etag in self.headers.get('If-None-Match', ''):
+            self.__send(304, etag, None)
+            return
+        self.__send(status, etag, body)
+
+    def __send(self, status: int, etag: str, body: bytes):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"public, max-age={self.max_age}")
+        if body is None:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __response(self) -> tuple[int, str | None, bytes]:
+        try:
+            obj = self.__route()
+        except ValueError as e:
+            return 400, None, self.__dumps({"error": str(e)})
+        if obj is None:
+            return 404, None, self.__dumps({"error": "not found"})
+        body = self.__dumps(obj)
+        return 200, '"' + hashlib.sha1(body).hexdigest() + '"', body
+
+    def __route(self):
+        url = urlsplit(self.path)
+        m = re_movie.match(url.path)
+        if m:
+            movie = self.repo.get(m.group(1))
+            return None if movie is None else movie._asdict()
+        m = re_director.match(url.path)
+        if m:
+            return self.__movies(self.repo.filmography(m.group(1)))
+        if url.path.rstrip("/") == "/search":
+            qs = parse_qs(url.query)
+            q = qs.get('q', [''])[0]
+            limit = qs.get('limit', ['20'])[0]
+            if not limit.isdecimal():
+                raise ValueError(f"limit={limit}")
+            return self.__movies(self.repo.search(q, min(int(limit), MAX_LIMIT)))
+        return None
+
+    def __movies(self, ids: tuple[str, ...]):
+        return [m._asdict() for m in self.repo.get_many(ids).values()]
+
+    @staticmethod
+    def __dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def serve(file: str, host: str, port: int, workers: int, ttl: float):
+    db = DBlite(file, immutable=True)
+    Handler.repo = MovieRepository(db)
+    Handler.cache = TTLCache(ttl)
+    Handler.max_age = int(ttl)
+    server = PoolHTTPServer((host, port), Handler, workers=workers)
+    logger.info(f"Sirviendo {file} en http://{host}:{port} ({workers} hilos)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servicio HTTP sobre imdb.sqlite")
+    parser.add_argument("db", nargs="?", default="imdb.sqlite")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--ttl", type=float, default=300, help="segundos que se guarda cada respuesta")
+    args = parser.parse_args()
+    config_log("log/server.log")
+    serve(args.db, args.host, args.port, args.workers, args.ttl)
@@ -6,5 +6,6 @@ CREATE TABLE EXTRA (
     wikipedia TEXT,
     countries TEXT,
     FOREIGN KEY (movie) REFERENCES MOVIE(id)
-)
-;
\ No newline at end of file
+);
+
+CREATE INDEX EXTRA_MOVIE ON EXTRA(movie);
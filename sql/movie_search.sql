@@ -0,0 +1,17 @@
+DROP TABLE IF EXISTS MOVIE_SEARCH;
+
+CREATE TABLE MOVIE_SEARCH (
+    id TEXT NOT NULL,
+    title TEXT,
+    type TEXT,
+    year INTEGER,
+    duration INTEGER,
+    votes INTEGER NOT NULL DEFAULT 0,
+    rating FLOAT NOT NULL DEFAULT 0,
+    titles TEXT NOT NULL DEFAULT '[]',
+    directors TEXT NOT NULL DEFAULT '[]',
+    filmaffinity INTEGER,
+    wikipedia TEXT,
+    countries TEXT,
+    PRIMARY KEY (id)
+) WITHOUT ROWID;
\ No newline at end of file
@@ -6,6 +6,7 @@ CREATE TABLE PERSON (
 
 CREATE TABLE MOVIE (
     id TEXT NOT NULL,
+    title TEXT,
     type TEXT,
     year INTEGER,
     duration INTEGER,
@@ -19,23 +20,21 @@ CREATE TABLE TITLE (
     title TEXT NOT NULL,
     PRIMARY KEY (movie, title),
     FOREIGN KEY (movie) REFERENCES MOVIE(id)
-);
+) WITHOUT ROWID;
 
-/*
 CREATE TABLE WORKER (
-    movie TEXT,
+    movie TEXT NOT NULL,
     person TEXT NOT NULL,
     category TEXT NOT NULL,
     PRIMARY KEY (movie, person, category),
     FOREIGN KEY (movie) REFERENCES MOVIE(id),
     FOREIGN KEY (person) REFERENCES PERSON(id)
-);
-*/
+) WITHOUT ROWID;
 
 CREATE TABLE DIRECTOR (
-    movie TEXT,
+    movie TEXT NOT NULL,
     person TEXT NOT NULL,
     PRIMARY KEY (movie, person),
     FOREIGN KEY (movie) REFERENCES MOVIE(id),
     FOREIGN KEY (person) REFERENCES PERSON(id)
-);
\ No newline at end of file
+) WITHOUT ROWID;
\ No newline at end of file
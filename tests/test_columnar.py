@@ -0,0 +1,102 @@
+import gzip
+import pytest
+from core import columnar, tsv
+from core.columnar import ColumnCache
+
+HEADER = ("id", "n", "f", "b", "s", "l")
+KINDS = ("str", "int", "float", "bool", "str", "list")
+ROWS = [
+    ("tt1", 1, 1.5, True, "Señor", ("a", "b")),
+    ("tt2", None, None, None, None, tuple()),
+    ("tt3", -3, 0.0, False, "straße", ("c", )),
+    ("tt4", 2 ** 40, 2.25, True, "", ("d", "e", "f")),
+    ("tt5", 0, -1.0, False, "x" * 1000, tuple()),
+]
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # para que las filas se repartan entre varios trozos
+    monkeypatch.setattr(columnar, "CHUNK", 2)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "data.tsv"
+    path.write_text("x")
+    return path
+
+
+def test_round_trip(tmp_path, source):
+    cache = ColumnCache(tmp_path / "cache")
+    assert cache.get(source) is None
+    reader = cache.put(source, HEADER, KINDS, iter(ROWS))
+    assert reader.header == HEADER and reader.rows == len(ROWS)
+    assert list(reader.iter_rows(HEADER)) == ROWS
+    assert list(reader.iter_rows(("l", "id"))) == [(r[5], r[0]) for r in ROWS]
+    again = cache.get(source)
+    assert again is not None and list(again.iter_rows(HEADER)) == ROWS
+
+
+def test_where_gets_raw_values(tmp_path, source):
+    reader = ColumnCache(tmp_path).put(source, HEADER, KINDS, ROWS)
+    seen = []
+
+    def where(n, b, s):
+        seen.append((n, b, s))
+        return b == '1'
+
+    assert [r[0] for r in reader.iter_rows(("id", ), where, ("n", "b", "s"))] == ["tt1", "tt4"]
+    assert seen[1] == ('\\N', '\\N', '\\N')
+    assert seen[2] == ('-3', '0', 'straße')
+
+
+def test_empty(tmp_path, source):
+    reader = ColumnCache(tmp_path).put(source, HEADER, KINDS, [])
+    assert reader.rows == 0 and list(reader.iter_rows(HEADER)) == []
+
+
+def test_new_version_replaces_old(tmp_path, source):
+    cache = ColumnCache(tmp_path / "cache")
+    cache.put(source, HEADER, KINDS, ROWS)
+    old = cache.target(source)
+    source.write_text("y")
+    cache.put(source, HEADER, KINDS, ROWS[:1])
+    assert not old.exists()
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == [cache.target(source).name]
+
+
+def test_failed_put_is_not_cached(tmp_path, source):
+    cache = ColumnCache(tmp_path)
+
+    def rows():
+        yield from ROWS
+        raise ValueError("tsv roto")
+
+    with pytest.raises(ValueError):
+        cache.put(source, HEADER, KINDS, rows())
+    assert cache.get(source) is None
+    assert list(cache.put(source, HEADER, KINDS, ROWS).iter_rows(HEADER)) == ROWS
+
+
+def test_iter_tuples_with_cache(tmp_path, monkeypatch):
+    path = tmp_path / "title.basics.tsv.gz"
+    with gzip.open(path, "wt") as f:
+        f.write("tconst\ttitleType\tisAdult\tstartYear\tdirectors\n")
+        f.write("tt1\tmovie\t0\t2000\tnm1,nm2\n")
+        f.write("tt2\tshort\t1\t\\N\t\\N\n")
+        f.write("tt3\tmovie\t0\t1999\tnm3\n")
+
+    def read():
+        return list(tsv.iter_tuples(
+            path, 'tconst', 'startYear', 'directors',
+            where=lambda t: t == 'movie', where_cols=('titleType', ), workers=1
+        ))
+
+    expected = read()
+    assert expected == [("tt1", 2000, ("nm1", "nm2")), ("tt3", 1999, ("nm3", ))]
+    cache = ColumnCache(tmp_path / "cache")
+    monkeypatch.setattr(tsv, "_CACHE", cache)
+    assert read() == expected
+    assert cache.get(path) is not None
+    assert read() == expected
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import pytest
+from http.client import HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from core.dataset import DatasetStore
+
+URL = "https://datasets.imdbws.com/title.ratings.tsv.gz"
+DATA = bytes(range(256)) * 64
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Hace de datasets.imdbws.com: ETag, 304, Range con If-Range y 416.
+    Con `truncate` > 0 las siguientes respuestas se cortan a la mitad
+    """
+    data = DATA
+    etag = '"v1"'
+    truncate = 0
+    requests: list[dict[str, str]] = []
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == cls.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start, status = 0, 200
+        rng = self.headers.get('Range')
+        if rng and self.headers.get('If-Range') == cls.etag:
+            start, status = int(rng.split("=")[1].rstrip("-")), 206
+            if start >= len(cls.data):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        body = cls.data[start:]
+        self.send_response(status)
+        self.send_header('ETag', cls.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if cls.truncate > 0:
+            cls.truncate -= 1
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    Handler.data, Handler.etag, Handler.truncate = DATA, '"v1"', 0
+    Handler.requests = []
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    th = Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    th.start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, server):
+    return DatasetStore(tmp_path, mirror=server, chances=2, wait=0, timeout=5)
+
+
+def _leave_part(store: DatasetStore, data: bytes, etag: str):
+    target = store.local_path(URL)
+    target.with_name(target.name + ".part").write_bytes(data)
+    target.with_name(target.name + ".json").write_text(json.dumps({'part': {'etag': etag}}))
+    return target
+
+
+def test_download_and_revalidate(store):
+    target = store.get(URL)
+    assert target.read_bytes() == DATA
+    assert 'If-None-Match' not in Handler.requests[0]
+    assert store.version(URL) == '"v1"'
+    assert Handler.requests[-1]['If-None-Match'] == '"v1"'
+    assert target.read_bytes() == DATA
+    assert not target.with_name(target.name + ".part").exists()
+
+
+def test_resume_with_range(store):
+    target = _leave_part(store, DATA[:1000], '"v1"')
+    assert store.get(URL).read_bytes() == DATA
+    assert Handler.requests[0]['Range'] == "bytes=1000-"
+    assert Handler.requests[0]['If-Range'] == '"v1"'
+
+
+def test_if_range_answered_with_200(store):
+    # el fichero ha cambiado desde que se empezo el .part
+    Handler.etag = '"v2"'
+    target = _leave_part(store, b"x" * 1000, '"v1"')
+    assert store.get(URL).read_bytes() == DATA
+    assert len(Handler.requests) == 1
+    assert json.loads(target.with_name(target.name + ".json").read_text())['etag'] == '"v2"'
+
+
+def test_truncated_body_is_resumed(store):
+    Handler.truncate = 1
+    assert store.get(URL).read_bytes() == DATA
+    assert len(Handler.requests) == 2
+    assert Handler.requests[1]['Range'] == f"bytes={len(DATA) // 2}-"
+
+
+def test_truncated_body_without_chances(tmp_path, server):
+    Handler.truncate = 1
+    store = DatasetStore(tmp_path, mirror=server, chances=1, wait=0, timeout=5)
+    with pytest.raises(HTTPException):
+        store.get(URL)
+    assert not store.local_path(URL).exists()
+
+
+def test_complete_part_416(store):
+    _leave_part(store, DATA, '"v1"')
+    assert store.get(URL).read_bytes() == DATA
+    assert len(Handler.requests) == 2
+    assert 'Range' not in Handler.requests[1]
+
+
+def test_version_offline(tmp_path):
+    ds = DatasetStore(tmp_path, offline=True)
+    with pytest.raises(FileNotFoundError):
+        ds.version(URL)
+    target = ds.local_path(URL)
+    target.write_bytes(b"tconst\n")
+    assert ds.version(URL) == hashlib.sha256(b"tconst\n").hexdigest()
+    target.with_name(target.name + ".json").write_text(json.dumps({'etag': '"abc"'}))
+    assert ds.version(URL) == '"abc"'
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import threading
+import pytest
+from core.dblite import DBlite
+
+
+def _writers():
+    return [t for t in threading.enumerate() if t.name == "DBlite-writer"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DBlite(str(tmp_path / "test.sqlite"), async_write=True, quick_release=True)
+    db.execute("CREATE TABLE T (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    yield db
+    db.close()
+
+
+def _fork():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="sin fork")
+def test_writer_is_stopped_before_fork(db):
+    db.insert_rows("T", ("id", "name"), ((i, str(i)) for i in range(1000)), batch_bytes=64)
+    db.executemany("INSERT INTO T (id, name) VALUES (?, ?)", (1000, "x"))
+    db.flush()
+    assert len(_writers()) == 1
+    _fork()
+    assert _writers() == []
+    # lo pendiente ya esta escrito y el hilo vuelve a arrancar al escribir
+    assert db.to_tuple("select count(*) from T") == (1001, )
+    db.executemany("INSERT INTO T (id, name) VALUES (?, ?)", (1001, "y"))
+    db.flush()
+    assert len(_writers()) == 1
+    db.commit()
+    assert db.to_tuple("select count(*) from T") == (1002, )
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="sin fork")
+def test_writer_error_survives_fork(db):
+    db.executemany("INSERT INTO T (id, name) VALUES (?, ?)", (1, None))
+    db.flush()
+    _fork()
+    with pytest.raises(sqlite3.IntegrityError):
+        db.commit()
+    db.executemany("INSERT INTO T (id, name) VALUES (?, ?)", (2, "ok"))
+    db.flush()
+    db.commit()
+    assert db.to_tuple("select id from T") == (2, )
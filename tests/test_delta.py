@@ -0,0 +1,100 @@
+import pytest
+from core.dblite import DBlite
+from core.filemanager import FM
+from core.schema import to_int_keys
+from core.delta import (
+    DeltaTable, can_delta, stage_delta, apply_delta,
+    read_sources, write_sources
+)
+
+TABLES = ("MOVIE", "PERSON", "TITLE", "DIRECTOR", "WORKER")
+BEFORE = {
+    'MOVIE': [("tt0000001", "Uno", "movie", 2000, 90, 5.0, 10), ("tt0000002", "Dos", "movie", 2001, None, 0, 0)],
+    'PERSON': [("nm0000001", "Uno"), ("nm0000002", "Dos")],
+    'TITLE': [("tt0000001", "Uno"), ("tt0000002", "Dos")],
+    'DIRECTOR': [("tt0000001", "nm0000001"), ("tt0000002", "nm0000002")],
+    'WORKER': [],
+}
+AFTER = {
+    'MOVIE': [("tt0000001", "One", "movie", 2000, 90, 6.0, 12), ("tt0000003", None, "short", None, 10, 0, 0)],
+    'PERSON': [("nm0000001", "Uno"), ("nm0000003", "Tres")],
+    'TITLE': [("tt0000001", "Uno"), ("tt0000001", "One"), ("tt0000003", "Tres")],
+    'DIRECTOR': [("tt0000001", "nm0000001"), ("tt0000003", "nm0000003")],
+    'WORKER': [("tt0000003", "nm0000001", "writer")],
+}
+
+
+def _insert(db: DBlite, data: dict[str, list[tuple]]):
+    for t in TABLES:
+        for row in data[t]:
+            db.execute(f"INSERT INTO {t} VALUES ({', '.join('?' * len(row))})", *row)
+    db.commit()
+
+
+def _dump(db: DBlite):
+    return {t: sorted(db.select(f"select * from {t}")) for t in TABLES}
+
+
+@pytest.fixture(params=("text", "int"))
+def db(request, tmp_path):
+    file = str(tmp_path / "imdb.sqlite")
+    db = DBlite(file, quick_release=True)
+    db.executescript(FM.load("sql/schema.sql"))
+    _insert(db, BEFORE)
+    if request.param == "int":
+        to_int_keys(db)
+    yield db
+    db.close()
+
+
+def test_apply_delta(db):
+    assert can_delta(db.file, *TABLES)
+    delta = stage_delta(db, *TABLES)
+    # mientras tanto la tabla temporal oculta a la real
+    assert _dump(db)['MOVIE'] == []
+    _insert(db, AFTER)
+    apply_delta(db, delta)
+    assert _dump(db) == {t: sorted(v) for t, v in AFTER.items()}
+    assert db.to_tuple("pragma foreign_key_check") == tuple()
+
+
+def test_apply_delta_without_changes(db):
+    delta = stage_delta(db, *TABLES)
+    _insert(db, BEFORE)
+    apply_delta(db, delta)
+    assert _dump(db) == {t: sorted(v) for t, v in BEFORE.items()}
+
+
+def test_delta_table_keys(db):
+    d = DeltaTable(db, "DIRECTOR")
+    assert d.pk == ("movie", "person")
+    if d.physical != "DIRECTOR":
+        assert d.prefix == {'movie': 'tt', 'person': 'nm'}
+
+
+def test_stage_delta_needs_primary_key(db):
+    db.execute("CREATE TABLE NOKEY (a TEXT)")
+    with pytest.raises(ValueError):
+        stage_delta(db, "NOKEY")
+
+
+def test_can_delta(tmp_path, db):
+    assert not can_delta(str(tmp_path / "no.sqlite"), *TABLES)
+    assert not can_delta(db.file, *TABLES, "EXTRA")
+
+
+def test_can_delta_with_other_columns(tmp_path):
+    # una imdb.sqlite de antes de MOVIE.title
+    db = DBlite(str(tmp_path / "imdb.sqlite"), quick_release=True)
+    db.executescript(FM.load("sql/schema.sql"))
+    db.execute("ALTER TABLE MOVIE DROP COLUMN title")
+    db.close()
+    assert not can_delta(db.file, *TABLES)
+
+
+def test_sources(tmp_path, db):
+    assert read_sources(str(tmp_path / "no.sqlite")) == {}
+    assert read_sources(db.file) == {}
+    write_sources(db, {'a': '1', 'b': '2'})
+    write_sources(db, {'a': '3'})
+    assert read_sources(db.file) == {'a': '3'}
@@ -0,0 +1,47 @@
+import logging
+from core.idset import IdSet
+
+
+def test_add_contains_len():
+    s = IdSet("tt", ("tt0000001", "tt0000042", "tt0000001"))
+    assert len(s) == 2
+    assert "tt0000042" in s
+    assert "tt0000002" not in s
+    assert "nm0000042" not in s
+    assert 42 not in s
+
+
+def test_iter_in_numeric_order_and_padded():
+    s = IdSet("nm", ("nm10000001", "nm0000009", "nm0000123", "nm1"))
+    assert list(s) == ["nm0000001", "nm0000009", "nm0000123", "nm10000001"]
+
+
+def test_bad_ids_are_skipped_and_logged(caplog):
+    s = IdSet("nm")
+    with caplog.at_level(logging.WARNING, logger="core.idset"):
+        assert s.add("nm0000001") is True
+        assert s.add("Q42") is False
+        assert s.add("tt0000001") is False
+        assert s.add(None) is False
+        s.update(("nm0000002", "nmABC", "nm-1"))
+    assert list(s) == ["nm0000001", "nm0000002"]
+    assert len(caplog.records) == 5
+
+
+def test_discard_and_difference():
+    s = IdSet("tt", ("tt0000001", "tt0000002", "tt0000003"))
+    d = s.difference(("tt0000002", "xx", "tt0000099"))
+    assert list(d) == ["tt0000001", "tt0000003"]
+    assert len(s) == 3
+    s.discard("tt0000001")
+    s.discard("tt0000001")
+    s.difference_update(("tt0000003", ))
+    assert list(s) == ["tt0000002"] and len(s) == 1
+
+
+def test_copy_is_independent():
+    s = IdSet("tt", ("tt0000001", ))
+    c = s.copy()
+    c.add("tt0000500")
+    assert "tt0000500" not in s
+    assert len(c) == 2
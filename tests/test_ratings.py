@@ -0,0 +1,68 @@
+import gzip
+import pytest
+from core.dblite import DBlite
+from core.filemanager import FM
+from core.schema import to_int_keys
+from core.ratings import refresh_ratings
+
+BEFORE = {
+    "tt0000001": (5.0, 10),
+    "tt0000002": (6.0, 20),
+    "tt0000003": (7.0, 30),
+    "tt0000004": (8.0, 40),
+    "tt0000005": (0, 0),
+}
+RATINGS = {
+    "tt0000001": (5.5, 11),
+    "tt0000002": (6.0, 20),
+}
+AFTER = {
+    "tt0000001": (5.5, 11),
+    "tt0000002": (6.0, 20),
+    # ya no esta en title.ratings
+    "tt0000003": (0, 0),
+    # MAIN_MOVIE, con la valoracion de OMDb
+    "tt0000004": (8.0, 40),
+    "tt0000005": (0, 0),
+}
+
+
+@pytest.fixture
+def url(tmp_path):
+    path = tmp_path / "title.ratings.tsv.gz"
+    with gzip.open(path, "wt") as f:
+        f.write("tconst\taverageRating\tnumVotes\n")
+        for k, (r, v) in RATINGS.items():
+            f.write(f"{k}\t{r}\t{v}\n")
+    return path
+
+
+@pytest.fixture(params=("text", "int"))
+def db(request, tmp_path):
+    db = DBlite(str(tmp_path / "imdb.sqlite"), quick_release=True)
+    db.executescript(FM.load("sql/schema.sql"))
+    for k, (r, v) in BEFORE.items():
+        db.execute("INSERT INTO MOVIE (id, type, rating, votes) VALUES (?, 'movie', ?, ?)", k, r, v)
+    db.executescript(FM.load("sql/movie_search.sql"))
+    db.execute("INSERT INTO MOVIE_SEARCH (id, type, rating, votes) SELECT id, type, rating, votes FROM MOVIE")
+    db.commit()
+    if request.param == "int":
+        to_int_keys(db)
+    yield db
+    db.close()
+
+
+def _ratings(db: DBlite, table: str):
+    return {k: (r, v) for k, r, v in db.select(f"select id, rating, votes from {table}")}
+
+
+def test_refresh_ratings(db, url):
+    assert refresh_ratings(db, url, keep=("tt0000004", "tt0000099")) == 2
+    assert _ratings(db, "MOVIE") == AFTER
+    assert _ratings(db, "MOVIE_SEARCH") == AFTER
+    assert refresh_ratings(db, url, keep=("tt0000004", )) == 0
+
+
+def test_refresh_ratings_without_keep(db, url):
+    refresh_ratings(db, url)
+    assert _ratings(db, "MOVIE")["tt0000004"] == (0, 0)
@@ -0,0 +1,57 @@
+import pytest
+from core.dblite import DBlite
+from core.filemanager import FM
+from core.schema import to_int_keys, is_int_keys
+
+QUERIES = (
+    "select * from MOVIE where id = ?",
+    "select * from TITLE where movie = ?",
+    "select p.name from DIRECTOR d join PERSON p on p.id = d.person where d.movie = ?",
+    "select * from EXTRA where movie = ?",
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DBlite(str(tmp_path / "imdb.sqlite"), quick_release=True)
+    db.executescript(FM.load("sql/schema.sql"))
+    db.executescript(FM.load("sql/extra.sql"))
+    db.execute("INSERT INTO MOVIE (id, type) VALUES ('tt0000001', 'movie'), ('tt0000002', 'movie')")
+    db.execute("INSERT INTO PERSON (id, name) VALUES ('nm0000001', 'Uno')")
+    db.execute("INSERT INTO TITLE (movie, title) VALUES ('tt0000001', 'Uno'), ('tt0000002', 'Dos')")
+    db.execute("INSERT INTO DIRECTOR (movie, person) VALUES ('tt0000001', 'nm0000001')")
+    # EXTRA puede apuntar a peliculas que ya no estan en MOVIE
+    db.execute("INSERT INTO EXTRA (movie, wikipedia) VALUES ('tt0000001', 'a'), ('tt9999999', 'b')")
+    db.commit()
+    yield db
+    db.close()
+
+
+def _dump(db: DBlite):
+    return {
+        t: sorted(db.select(f"select * from {t}"))
+        for t in ("MOVIE", "PERSON", "TITLE", "DIRECTOR", "EXTRA")
+    }
+
+
+def test_to_int_keys(db):
+    before = _dump(db)
+    to_int_keys(db)
+    assert is_int_keys(db)
+    assert _dump(db) == before
+    db.execute("UPDATE MOVIE SET votes = 3 WHERE id = 'tt0000002'")
+    db.execute("INSERT INTO DIRECTOR (movie, person) VALUES ('tt0000002', 'nm0000001')")
+    db.execute("DELETE FROM TITLE WHERE movie = 'tt0000001'")
+    assert db.to_tuple("select votes from MOVIE where id = 'tt0000002'") == (3, )
+    assert db.to_tuple("select movie from DIRECTOR where person = 'nm0000001' order by movie") == ("tt0000001", "tt0000002")
+    assert db.to_tuple("select movie from TITLE") == ("tt0000002", )
+
+
+def test_views_use_indexes(db):
+    to_int_keys(db)
+    for sql in QUERIES:
+        plan = " ".join(r[-1] for r in db.select("explain query plan " + sql, "tt0000001"))
+        assert "SCAN" not in plan, (sql, plan)
+    # el id en texto solo se indexa una vez
+    indexes = db.to_tuple("select name from sqlite_master where type = 'index' and name like '%_TXT'")
+    assert sorted(indexes) == ["EXTRA_INT_MOVIE_TXT", "MOVIE_INT_ID_TXT", "PERSON_INT_ID_TXT"]
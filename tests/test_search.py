@@ -0,0 +1,48 @@
+import sqlite3
+import pytest
+from core.search import FTS_TABLE, TOKENIZE, normalize, to_match
+
+
+@pytest.fixture
+def con():
+    con = sqlite3.connect(":memory:")
+    con.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, content='', tokenize='{TOKENIZE}')")
+    con.executemany(
+        f"INSERT INTO {FTS_TABLE}(rowid, title) VALUES (?, ?)",
+        (
+            (1, "El Señor de los Anillos\nThe Lord of the Rings"),
+            (2, "Die Straße"),
+            (3, "Amélie"),
+        )
+    )
+    yield con
+    con.close()
+
+
+def search(con: sqlite3.Connection, text: str):
+    return [r[0] for r in con.execute(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ? ORDER BY rank",
+        (to_match(text), )
+    )]
+
+
+def test_normalize():
+    assert normalize("El SEÑOR") == "el senor"
+    assert normalize("Straße") == "straße"
+
+
+def test_to_match():
+    assert to_match("el señor") == '"el" "senor"*'
+    assert to_match('"(*') is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("el senor de los anillos", [1]),
+    ("EL SEÑOR", [1]),
+    ("lord of the ri", [1]),
+    ("straße", [2]),
+    ("STRASSE", []),
+    ("amelie", [3]),
+])
+def test_match_like_the_tokenizer(con, text, expected):
+    assert search(con, text) == expected
@@ -0,0 +1,92 @@
+import gzip
+import pytest
+from core import tsv
+from core.tsv import iter_tuples, merge_join
+
+
+def test_merge_join():
+    left = [("tt1", "a"), ("tt2", "b"), ("tt4", "c")]
+    r1 = [("tt0", 0), ("tt2", 2), ("tt3", 3), ("tt4", 4)]
+    r2 = [("tt1", "x")]
+    assert list(merge_join(left, r1, r2)) == [
+        (("tt1", "a"), None, ("tt1", "x")),
+        (("tt2", "b"), ("tt2", 2), None),
+        (("tt4", "c"), ("tt4", 4), None),
+    ]
+
+
+def test_merge_join_str_order():
+    # orden de str, no numerico: tt10 va antes que tt9
+    left = [("tt10", ), ("tt9", )]
+    assert list(merge_join(left, [("tt9", 9)])) == [(("tt10", ), None), (("tt9", ), ("tt9", 9))]
+
+
+def test_merge_join_empty():
+    assert list(merge_join([], [("tt1", )])) == []
+    assert list(merge_join([("tt1", )], [])) == [(("tt1", ), None)]
+    assert list(merge_join([("tt1", )])) == [(("tt1", ), )]
+
+
+def test_merge_join_starts_with_left():
+    started = []
+
+    def rows(name, keys):
+        started.append(name)
+        for k in keys:
+            yield (k, )
+
+    out = merge_join(rows("left", ("tt1", )), rows("right", ("tt1", )))
+    assert started == []
+    next(out)
+    assert started == ["left", "right"]
+    out = merge_join(rows("left", ()), rows("right", ("tt1", )))
+    started.clear()
+    assert list(out) == [] and started == ["left"]
+
+
+@pytest.mark.parametrize("left,right", [
+    ([("tt2", ), ("tt1", )], []),
+    ([("tt1", ), ("tt1", )], []),
+    ([("tt1", ), ("tt3", )], [("tt2", ), ("tt1", )]),
+    ([("tt1", ), ("tt3", )], [("tt1", ), ("tt1", )]),
+])
+def test_merge_join_unsorted_or_repeated(left, right):
+    with pytest.raises(ValueError):
+        list(merge_join(left, right))
+
+
+@pytest.fixture
+def tsv_gz(tmp_path):
+    path = tmp_path / "title.ratings.tsv.gz"
+    with gzip.open(path, "wt") as f:
+        f.write("tconst\taverageRating\tnumVotes\n")
+        # varios bloques de BLOCK_SIZE, para que importe el orden
+        for i in range(1, 400001):
+            votes = str(i) if i % 3 else "\\N"
+            f.write(f"tt{i:07d}\t{i % 10}.5\t{votes}\n")
+    return path
+
+
+def test_iter_tuples_serial_when_pool_busy(tsv_gz):
+    expected = list(iter_tuples(tsv_gz, 'tconst', 'numVotes', workers=1))
+    assert len(expected) == 400000 and expected[2] == ("tt0000003", 0)
+    assert list(iter_tuples(tsv_gz, 'tconst', 'numVotes', workers=2)) == expected
+    # con otra lectura usando los procesos se decodifica en este proceso
+    with tsv._POOL:
+        assert list(iter_tuples(tsv_gz, 'tconst', 'numVotes', workers=2)) == expected
+    assert not tsv._POOL.locked()
+
+
+def test_limit_workers(monkeypatch):
+    monkeypatch.setattr(tsv, "WORKERS", 7)
+    with tsv.limit_workers(3):
+        assert tsv.WORKERS == 3
+        with tsv.limit_workers(10):
+            assert tsv.WORKERS == 3
+        with tsv.limit_workers(0):
+            assert tsv.WORKERS == 1
+    assert tsv.WORKERS == 7
+    with pytest.raises(RuntimeError):
+        with tsv.limit_workers(2):
+            raise RuntimeError()
+    assert tsv.WORKERS == 7
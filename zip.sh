@@ -1,6 +1,6 @@
 #!/bin/bash
 mkdir -p out/
-cat log/build_db.log log/complete_db.log > out/execution.log
+cat log/build_db.log log/complete_db.log log/movie_search_db.log > out/execution.log
 tar -czf out/imdb.tar.gz --transform='s!.*/!!' *.sqlite log/*.log
 cd out/
 tree -H . -o index.html